@@ -0,0 +1,41 @@
+// Clientside callbacks of the /inzichten page. The stored trend (crime/trends.py) holds the yearly values
+// per category and the change between every pair of years, so moving a slider only slices those arrays.
+
+function yearIndex(trend, year) {
+    return trend.years.indexOf(year);
+}
+
+// same text as python's f'{value:.1f}%'
+function percentText(value) {
+    if (value === null) {
+        return 'nan%';
+    }
+    return value.toFixed(1) + '%';
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    inzichten: {
+        bars: function (years, trend, figure) {
+            const change = trend.change[yearIndex(trend, years[0])][yearIndex(trend, years[1])];
+            const trace = Object.assign({}, figure.data[0], {x: change, text: change.map(percentText)});
+            return Object.assign({}, figure, {data: [trace]});
+        },
+        line: function (years, trend, figure) {
+            const start = yearIndex(trend, years[0]);
+            const end = yearIndex(trend, years[1]) + 1;
+            const rows = trend.difference ? trend.values.slice(start, end) : trend.change[start].slice(start, end);
+            const data = figure.data.map(function (trace, k) {
+                return Object.assign({}, trace, {
+                    x: trend.years.slice(start, end),
+                    y: rows.map(function (row) { return row[k]; })
+                });
+            });
+            return Object.assign({}, figure, {data: data});
+        },
+        // zooms of the scatter for zoom_scatter, only when the server binned its points
+        scatterView: function (relayout, figure) {
+            const meta = figure && figure.layout && figure.layout.meta;
+            return meta && meta.binned ? relayout : window.dash_clientside.no_update;
+        }
+    }
+});
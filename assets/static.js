@@ -0,0 +1,96 @@
+// Clientside versions of the server callbacks, used by the static export (crime/export.py). The export
+// writes every output the server callbacks can give as a JSON file named after their inputs (keyName), so
+// here a callback is a fetch. The exported index.html names the directory in <meta name="crime-static">,
+// in the live app there is no such tag and nothing below is used.
+
+const FNV_OFFSETS = [0x811c9dc5, 0x050c5d1f];
+const FNV_PRIME = 0x01000193;
+
+function staticRoot() {
+    const meta = document.querySelector('meta[name="crime-static"]');
+    return meta ? meta.content : null;
+}
+
+// file name of a key, two 32 bit FNV-1a hashes of its JSON. Same as key_name in crime/export.py
+function keyName(key) {
+    const bytes = new TextEncoder().encode(JSON.stringify(key));
+    return FNV_OFFSETS.map(function (offset) {
+        let hash = offset;
+        bytes.forEach(function (byte) {
+            hash = Math.imul(hash ^ byte, FNV_PRIME) >>> 0;
+        });
+        return hash.toString(16).padStart(8, '0');
+    }).join('');
+}
+
+function exported(kind, ...args) {
+    const url = staticRoot() + kind + '/' + keyName([kind].concat(args)) + '.json';
+    return fetch(url).then(function (response) {
+        if (!response.ok) {
+            throw new Error('not exported: ' + JSON.stringify([kind].concat(args)));
+        }
+        return response.json();
+    });
+}
+
+function triggeredId() {
+    const triggered = window.dash_clientside.callback_context.triggered;
+    return triggered.length ? triggered[0].prop_id.split('.')[0] : null;
+}
+
+// a static file server answers /_dash-layout without a JSON content type, which the renderer refuses,
+// so those two are fetched from the .json files the export writes next to them
+if (staticRoot() !== null) {
+    const serverFetch = window.fetch;
+    window.fetch = function (url, options) {
+        if (typeof url === 'string' && /\/_dash-(layout|dependencies)$/.test(url)) {
+            url += '.json';
+        }
+        return serverFetch.call(this, url, options);
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    crime_static: {
+        // the router of dash pages
+        page: function (pathname) {
+            const path = pathname.replace(/\/+$/, '') || '/';
+            return exported('page', path).then(function (page) {
+                return [page.layout, {title: page.title}];
+            }, function () {
+                return [{namespace: 'dash_html_components', type: 'H1', props: {children: '404 - Page not found'}},
+                        {title: document.title}];
+            });
+        },
+        // changemap, only the tabs. Zooming keeps the gemeenten, the finer levels need the server
+        map: function (tab) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (triggeredId() !== 'table-tabs') {
+                return [noUpdate, noUpdate];
+            }
+            return exported('map', tab).then(function (figure) {
+                return [figure, noUpdate];
+            });
+        },
+        // update_region, every region at once. The background job of the server (region-job) isn't used
+        region: function (regio, clickData, depth) {
+            const noUpdate = window.dash_clientside.no_update;
+            const trigger = triggeredId();
+            if (trigger === 'table-depth') {
+                return exported('table', regio, depth).then(function (table) {
+                    return [noUpdate, noUpdate, noUpdate].concat(table, [noUpdate]);
+                });
+            }
+            const crime = trigger === 'bars' ? clickData.points[0].label : 'Misdrijven, totaal';
+            if (trigger === 'bars') {
+                return exported('crime', regio, crime).then(function (outputs) {
+                    return [outputs.line, noUpdate, outputs.cards, noUpdate, noUpdate, noUpdate];
+                });
+            }
+            return Promise.all([exported('crime', regio, crime), exported('bars', regio),
+                                exported('table', regio, depth)]).then(function ([outputs, bars, table]) {
+                return [outputs.line, bars, outputs.cards].concat(table, [noUpdate]);
+            });
+        }
+    }
+});
@@ -0,0 +1,240 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+# Benchmarks the dashboard offline, through the Flask test client:
+#   python benchmarks/bench.py                      # writes benchmarks/results/<commit>.json
+#   python benchmarks/bench.py --compare old.json   # and prints the change against an earlier run
+# It times the cold start (import and first page loads, in a fresh interpreter), every server callback
+# for every value of its inputs (every region, crime category, map tab, table level, ...) and the
+# /inzichten figures for every pair of years, and records the response sizes. Every callback runs twice,
+# 'cold' is the first call for an input (memoized figures are built), 'warm' the second.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+PAGES = ['/', '/inzichten']
+# inputs that start out empty in the browser, the values below are what a user action sends
+INITIAL = {'bars.clickData': None, 'map-graph.relayoutData': None}
+
+
+def dash_request(client, key, callback, values, changed):
+    # POST to /_dash-update-component as the browser does. values: 'id.property' -> value
+    def spec(dependency):
+        return dict(dependency, value=values.get(f"{dependency['id']}.{dependency['property']}"))
+
+    outputs = [dict(zip(['id', 'property'], part.rsplit('.', 1)))
+               for part in (key[2:-2].split('...') if key.startswith('..') else [key])]
+    body = {'output': key, 'outputs': outputs if key.startswith('..') else outputs[0],
+            'inputs': [spec(d) for d in callback['inputs']], 'state': [spec(d) for d in callback['state']],
+            'changedPropIds': [changed]}
+    start = time.perf_counter()
+    response = client.post('/_dash-update-component', json=body)
+    # a background callback (crime/background.py) answers with its job, then polled for the result
+    job = response.get_json(silent=True) if response.status_code == 200 else None
+    while job and 'cacheKey' in job and 'response' not in job:
+        time.sleep(0.01)
+        response = client.post('/_dash-update-component', json=body,
+                               query_string={'cacheKey': job['cacheKey'], 'job': job['job']})
+        if response.status_code != 200 or 'response' in (response.get_json(silent=True) or {}):
+            break
+    return time.perf_counter() - start, response
+
+
+def cold_start():
+    # run in a fresh interpreter by main(), prints the timings as json
+    start = time.perf_counter()
+    import dashboard
+    result = {'import_s': time.perf_counter() - start}
+    client = dashboard.server.test_client()
+    for path in ['/', '/_dash-layout', '/_dash-dependencies']:
+        begin = time.perf_counter()
+        response = client.get(path)
+        result[f'GET {path}'] = {'s': time.perf_counter() - begin, 'bytes': len(response.data)}
+    key = '.._pages_content.children..._pages_store.data..'
+    callback = dashboard.app.callback_map[key]
+    for page in PAGES:
+        seconds, response = dash_request(client, key, callback, {'_pages_location.pathname': page,
+                                                                 '_pages_location.search': ''},
+                                         '_pages_location.pathname')
+        result[f'page {page}'] = {'s': seconds, 'bytes': len(response.data)}
+    result['total_s'] = time.perf_counter() - start
+    result['maxrss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(result))
+
+
+def input_values(regions):
+    # values to try for every callback input, the first (or the INITIAL one) is used while another
+    # input is varied
+    from crime.store import get_store
+    from pages.dashboard_main_page import MAP_METRICS, TABLE_DEPTHS
+    store = get_store()
+    main = store.top_categories()
+    return {
+        'city-picker.value': regions,
+        'bars.clickData': [{'points': [{'label': misdaad}]} for misdaad in main[1:]],
+        'table-depth.value': [depth for _, depth in reversed(TABLE_DEPTHS)],
+        'table-tabs.value': list(MAP_METRICS),
+        'map-graph.relayoutData': [{'mapbox.center': {'lon': 4.9, 'lat': 52.37}, 'mapbox.zoom': 10},
+                                   {'mapbox.center': {'lon': 5.29, 'lat': 52.13}, 'mapbox.zoom': 6}],
+        'gemeente-table.page_current': [0, 1, 5],
+        'gemeente-table.page_size': [50],
+        'gemeente-table.sort_by': [[], [{'column_id': str(store.latest_year), 'direction': 'desc'}],
+                                   [{'column_id': 'Regio', 'direction': 'asc'}]],
+        'gemeente-table.filter_query': ['', '{Regio} icontains dam', f'{{{store.latest_year}}} > 60'],
+        '_pages_location.pathname': PAGES,
+        '_pages_location.search': [''],
+    }
+
+
+def summarize(timings, sizes):
+    timings = sorted(timings)
+    return {'calls': len(timings), 'mean_ms': statistics.mean(timings) * 1000,
+            'p50_ms': timings[len(timings) // 2] * 1000, 'p95_ms': timings[int(len(timings) * 0.95)] * 1000,
+            'max_ms': timings[-1] * 1000, 'mean_bytes': statistics.mean(sizes), 'max_bytes': max(sizes)}
+
+
+def follow(client, callbacks, values, seconds, response):
+    # an output that is the input of another server callback starts that one too, as in the browser
+    # (update_region names the region for build_region in region-job). callbacks: 'id.property' -> (key, callback)
+    body = response.get_json(silent=True) if response.status_code == 200 else None
+    for component, props in (body or {}).get('response', {}).items():
+        for prop, value in props.items():
+            if f'{component}.{prop}' in callbacks and value is not None:
+                key, callback = callbacks[f'{component}.{prop}']
+                more, response = dash_request(client, key, callback, dict(values, **{f'{component}.{prop}': value}),
+                                              f'{component}.{prop}')
+                return follow(client, callbacks, values, seconds + more, response)
+    return seconds, response
+
+
+def bench_callbacks(app, values):
+    # every server callback, one input varied at a time over all its values
+    client = app.server.test_client()
+    client.get('/')
+    results = {}
+    chained = {f"{d['id']}.{d['property']}": (key, callback)
+               for key, callback in app.callback_map.items() for d in callback['inputs']}
+    for key, callback in app.callback_map.items():
+        inputs = [f"{d['id']}.{d['property']}" for d in callback['inputs']]
+        if not any(name in values for name in inputs):
+            continue # nothing to vary
+        defaults = dict({name: choices[0] for name, choices in values.items()}, **INITIAL)
+        calls = [(name, dict(defaults, **{name: value})) for name in inputs if name in values
+                 for value in values[name]]
+        func = callback['callback']
+        name = func.__name__ if not func.__module__.startswith('dash') else key # the page router
+        for run in ['cold', 'warm']:
+            timings, sizes, errors = [], [], 0
+            for changed, call in calls:
+                seconds, response = dash_request(client, key, callback, call, changed)
+                seconds, response = follow(client, chained, call, seconds, response)
+                if response.status_code not in (200, 204):
+                    errors += 1
+                    continue
+                timings.append(seconds)
+                sizes.append(len(response.data))
+            if timings:
+                results.setdefault(name, {})[run] = dict(summarize(timings, sizes), errors=errors)
+    return results
+
+
+def bench_trends():
+    # the /inzichten figures for every pair of years. In the browser the sliders slice the stored trends
+    # (assets/inzichten.js), the server builds these for the first page view
+    import plotly.io as pio
+    from crime.trends import PARAMETERS, yearly_trend
+    from pages.page2 import bars_crime_change, line_yearly_crime
+    results = {}
+    yearly_trend.cache_clear()
+    for parameter in PARAMETERS:
+        start = time.perf_counter()
+        trend = yearly_trend(parameter)
+        results[f'trend {parameter}'] = {'s': time.perf_counter() - start,
+                                        'store_bytes': len(json.dumps(trend.to_store()))}
+        pairs = list(itertools.combinations(trend.years.tolist(), 2))
+        for builder in [bars_crime_change, line_yearly_crime]:
+            builder.invalidate()
+            for run in ['cold', 'warm']:
+                timings, sizes = [], []
+                for year1, year2 in pairs:
+                    start = time.perf_counter()
+                    figure = builder(year1, year2, parameter)
+                    timings.append(time.perf_counter() - start)
+                    sizes.append(len(pio.to_json(figure, validate=False)))
+                results.setdefault(f'{builder.__name__} {parameter}', {})[run] = summarize(timings, sizes)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(old, new):
+    # relative change of the timings and sizes that are in both runs
+    def flatten(result, prefix=''):
+        for key, value in result.items():
+            if isinstance(value, dict):
+                yield from flatten(value, f'{prefix}{key} / ')
+            elif isinstance(value, (int, float)) and key not in ('calls', 'errors', 'regions', 'max_ms'):
+                yield f'{prefix}{key}', value
+
+    before = dict(flatten(old))
+    for key, value in flatten(new):
+        if before.get(key):
+            change = (value - before[key]) / before[key] * 100
+            if abs(change) >= 10:
+                print(f'{change:+7.1f}%  {key}: {before[key]:.4g} -> {value:.4g}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard through the Flask test client')
+    parser.add_argument('--output', help='result file, default benchmarks/results/<commit>.json')
+    parser.add_argument('--regions', type=int, help='only the first n regions of the dropdown')
+    parser.add_argument('--compare', help='earlier result file to compare with')
+    parser.add_argument('--cold-start', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.chdir(ROOT) # the data paths are relative to the project root
+    sys.path.insert(0, ROOT)
+    if args.cold_start:
+        return cold_start()
+
+    commit = git_commit()
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), '--cold-start'],
+                             capture_output=True, text=True, check=True)
+    result = {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'cold_start': json.loads(process.stdout.strip().splitlines()[-1])}
+
+    import dashboard
+    from pages.dashboard_main_page import region_options
+    regions = [option['value'] for option in region_options()][:args.regions]
+    result['regions'] = len(regions)
+    result['callbacks'] = bench_callbacks(dashboard.app, input_values(regions))
+    result['trends'] = bench_trends()
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=1)
+    for name, runs in result['callbacks'].items():
+        for run, stats in runs.items():
+            print(f"{name:24} {run:4} {stats['calls']:5} calls  p50 {stats['p50_ms']:7.1f} ms  "
+                  f"p95 {stats['p95_ms']:7.1f} ms  {stats['mean_bytes'] / 1024:7.1f} KB  {stats.get('errors', 0)} errors")
+    print(f"cold start: import {result['cold_start']['import_s']:.2f}s, total {result['cold_start']['total_s']:.2f}s")
+    print(f'results written to {output}')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+import argparse
+import gzip
+import http.client
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench import RESULTS_DIR, ROOT, git_commit
+
+# Load test of the dashboard under gunicorn, for sizing the deployment:
+#   python benchmarks/loadtest.py --workers 4 --threads 2 --users 16 --duration 60
+# starts gunicorn -c gunicorn.conf.py dashboard:server on a free port (or tests --url), and lets --users
+# simulated users replay sessions at the same time: open a page, switch regions, click bars, change the
+# table level, page and sort the gemeente table and zoom the scatter, like the browser does with POSTs
+# to /_dash-update-component. The /inzichten sliders run in the browser (assets/inzichten.js) and send
+# nothing. Reports requests/s, latency percentiles per callback and the memory of every worker, and
+# writes it all to benchmarks/results/loadtest-<commit>-w<workers>t<threads>.json.
+STARTUP_TIMEOUT = 300
+
+
+class Client:
+    # one user: a keep-alive connection, gzip like a browser
+    def __init__(self, host, port):
+        self.connection = http.client.HTTPConnection(host, port, timeout=120)
+
+    def request(self, method, path, body=None):
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.connection.close() # reconnects on the next request
+            raise
+        data = response.read()
+        if response.getheader('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return response.status, data
+
+
+class Dash:
+    # the callbacks of the app as the browser knows them, from /_dash-dependencies
+    def __init__(self, client):
+        status, data = client.request('GET', '/_dash-dependencies')
+        self.callbacks = {d['output']: d for d in json.loads(data)}
+        # 'id.property' -> key of the server callback it is an input of
+        self.chained = {f"{i['id']}.{i['property']}": key for key, d in self.callbacks.items()
+                        if d['clientside_function'] is None for i in d['inputs']}
+
+    def find(self, output):
+        # the callback writing to output, e.g. 'line.figure'
+        return next(key for key in self.callbacks if output in key.strip('.').split('...'))
+
+    def post(self, client, output, values, changed):
+        # (status, response json, requests made). values: 'id.property' -> value
+        return self.send(client, self.find(output), values, changed)
+
+    def send(self, client, key, values, changed):
+        callback = self.callbacks[key]
+
+        def spec(dependency):
+            return dict(dependency, value=values.get(f"{dependency['id']}.{dependency['property']}"))
+
+        outputs = [dict(zip(['id', 'property'], part.rsplit('.', 1))) for part in key.strip('.').split('...')]
+        body = {'output': key, 'outputs': outputs if key.startswith('..') else outputs[0],
+                'inputs': [spec(d) for d in callback['inputs']], 'state': [spec(d) for d in callback['state']],
+                'changedPropIds': [changed]}
+        status, data = client.request('POST', '/_dash-update-component', body)
+        requests = 1
+        result = json.loads(data) if status == 200 else None
+        # a background callback (crime/background.py) answers with a job, polled like the browser does
+        while result and 'cacheKey' in result and 'response' not in result:
+            time.sleep(callback['long']['interval'] / 1000)
+            status, data = client.request('POST', f"/_dash-update-component?cacheKey={result['cacheKey']}"
+                                                  f"&job={result['job']}", body)
+            requests += 1
+            result = json.loads(data) if status == 200 else None
+        # an output that is the input of another server callback starts that one, like build_region after
+        # update_region named the region in region-job
+        for component, props in (result or {}).get('response', {}).items():
+            for prop, value in props.items():
+                if value is not None and f'{component}.{prop}' in self.chained:
+                    status, result, more = self.send(client, self.chained[f'{component}.{prop}'],
+                                                     dict(values, **{f'{component}.{prop}': value}),
+                                                     f'{component}.{prop}')
+                    return status, result, requests + more
+        return status, result, requests
+
+
+def find_component(layout, component_id):
+    # props of the component with this id in a layout (or callback response) json
+    if isinstance(layout, dict):
+        if layout.get('props', {}).get('id') == component_id:
+            return layout['props']
+        layout = list(layout.values())
+    if isinstance(layout, list):
+        for child in layout:
+            found = find_component(child, component_id)
+            if found is not None:
+                return found
+    return None
+
+
+class Stats:
+    def __init__(self):
+        self.timings = {} # action -> seconds
+        self.requests = 0
+        self.errors = {}
+        self.callbacks = {} # action -> output of the callback it runs
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.timings, self.errors, self.requests = {}, {}, 0
+
+    def add(self, action, seconds, requests, ok):
+        with self.lock:
+            self.requests += requests
+            if ok:
+                self.timings.setdefault(action, []).append(seconds)
+            else:
+                self.errors[action] = self.errors.get(action, 0) + 1
+
+
+def session(dash, client, stats, rng, think, stop):
+    # one user going through the dashboard until stop is set
+    def act(action, output, values, changed):
+        stats.callbacks[action] = dash.find(output)
+        start = time.perf_counter()
+        try:
+            status, result, requests = dash.post(client, output, values, changed)
+        except (http.client.HTTPException, OSError, ValueError):
+            status, result, requests = None, None, 1
+        stats.add(action, time.perf_counter() - start, requests, status in (200, 204))
+        if think:
+            time.sleep(rng.expovariate(1 / think))
+        return result
+
+    def page(path):
+        start = time.perf_counter()
+        try:
+            ok = all(client.request('GET', url)[0] == 200 for url in ['/', '/_dash-layout'])
+        except (http.client.HTTPException, OSError):
+            ok = False
+        stats.add('GET /', time.perf_counter() - start, 2, ok)
+        return act(f'page {path}', '_pages_content.children',
+                   {'_pages_location.pathname': path, '_pages_location.search': ''}, '_pages_location.pathname')
+
+    while not stop.is_set():
+        result = page('/')
+        content = result and result['response']['_pages_content']['children']
+        regions = [o['value'] for o in (find_component(content, 'city-picker') or {}).get('options', [])]
+        bars = (find_component(content, 'bars') or {}).get('figure', {}).get('data', [{}])[0].get('x', [])
+        values = {'city-picker.value': 'Nederland', 'bars.clickData': None, 'table-depth.value': 4,
+                  'table-tabs.value': 'Misdrijven per 1000 Inw', 'map-graph.relayoutData': None}
+        for _ in range(rng.randint(2, 6)):
+            if stop.is_set() or not regions:
+                break
+            values['city-picker.value'] = rng.choice(regions)
+            act('region', 'line.figure', values, 'city-picker.value')
+            if bars and rng.random() < 0.6:
+                values['bars.clickData'] = {'points': [{'label': rng.choice(bars)}]}
+                act('bar click', 'line.figure', values, 'bars.clickData')
+            if rng.random() < 0.3:
+                values['table-depth.value'] = rng.randint(1, 4)
+                act('table level', 'crime-table.data', values, 'table-depth.value')
+            if rng.random() < 0.3:
+                values['table-tabs.value'] = rng.choice(['Geregistreerde Misdrijven', 'Misdrijven per 1000 Inw',
+                                                         'Opgehelderde Misdrijven Relatief'])
+                act('map tab', 'map-graph.figure', values, 'table-tabs.value')
+        if stop.is_set() or rng.random() < 0.5:
+            continue
+        result = page('/inzichten')
+        content = result and result['response']['_pages_content']['children']
+        scatter = (find_component(content, 'scatter-graph') or {}).get('figure', {})
+        table = {'gemeente-table.page_current': 0, 'gemeente-table.page_size': 50,
+                 'gemeente-table.sort_by': [], 'gemeente-table.filter_query': ''}
+        for _ in range(rng.randint(1, 3)):
+            changed = rng.choice(['gemeente-table.page_current', 'gemeente-table.sort_by'])
+            if changed == 'gemeente-table.page_current':
+                table[changed] = rng.randint(0, 5)
+            else:
+                table[changed] = [{'column_id': rng.choice(['Regio', 'Verschil']),
+                                   'direction': rng.choice(['asc', 'desc'])}]
+            act('gemeente table', 'gemeente-table.data', table, changed)
+        if not scatter.get('layout', {}).get('meta', {}).get('binned'):
+            continue # the browser zooms all points itself
+        x = rng.uniform(0, 100000)
+        act('scatter zoom', 'scatter-graph.figure',
+            {'scatter-view.data': {'xaxis.range[0]': x, 'xaxis.range[1]': x * 2 + 10000}}, 'scatter-view.data')
+
+
+def worker_pids(master):
+    pids = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == master:
+                        pids.append(int(name))
+            except (OSError, IndexError, ValueError):
+                continue
+    return sorted(pids)
+
+
+def memory(pid):
+    # rss and pss in MB. pss divides the pages shared with the master (preload_app) over the processes
+    result = {}
+    for path, keys in [(f'/proc/{pid}/status', {'VmRSS:': 'rss_mb'}), (f'/proc/{pid}/smaps_rollup', {'Pss:': 'pss_mb'})]:
+        try:
+            with open(path) as f:
+                for line in f:
+                    parts = line.split()
+                    if parts and parts[0] in keys:
+                        result[keys[parts[0]]] = int(parts[1]) / 1024
+        except OSError:
+            pass
+    return result
+
+
+def start_server(workers, threads, port):
+    pidfile = os.path.join(tempfile.mkdtemp(), 'gunicorn.pid')
+    env = dict(os.environ, CRIME_BIND=f'127.0.0.1:{port}', CRIME_WORKERS=str(workers), CRIME_THREADS=str(threads))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--pid', pidfile,
+                                'dashboard:server'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {process.returncode}')
+        try:
+            if Client('127.0.0.1', port).request('GET', '/')[0] == 200 and len(worker_pids(process.pid)) >= workers:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    def at(q):
+        return timings[min(int(len(timings) * q), len(timings) - 1)] * 1000
+    return {'count': len(timings), 'mean_ms': statistics.mean(timings) * 1000,
+            'p50_ms': at(0.5), 'p95_ms': at(0.95), 'p99_ms': at(0.99), 'max_ms': timings[-1] * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the dashboard under gunicorn with simulated users')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--users', type=int, default=8, help='simulated users at the same time')
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of load before measuring')
+    parser.add_argument('--think', type=float, default=0, help='mean seconds a user waits between actions')
+    parser.add_argument('--url', help='test a running server (host:port) instead of starting gunicorn')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='result file, default benchmarks/results/loadtest-<commit>-w<n>t<n>.json')
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        host, port = args.url.rsplit(':', 1)
+        port = int(port)
+    else:
+        host, port = '127.0.0.1', free_port()
+        print(f'starting gunicorn: {args.workers} workers, {args.threads} threads on port {port}')
+        server = start_server(args.workers, args.threads, port)
+    try:
+        dash = Dash(Client(host, port))
+        stats, stop = Stats(), threading.Event()
+        users = [threading.Thread(target=session, daemon=True,
+                                  args=(dash, Client(host, port), stats, random.Random(args.seed + i), args.think, stop))
+                 for i in range(args.users)]
+        for user in users:
+            user.start()
+        time.sleep(args.warmup)
+        stats.reset() # measure from here
+        start = time.perf_counter()
+        peak = {}
+        while time.perf_counter() - start < args.duration:
+            time.sleep(1)
+            for pid in worker_pids(server.pid) if server else []:
+                for key, value in memory(pid).items():
+                    peak.setdefault(pid, {})[key] = max(peak.get(pid, {}).get(key, 0), value)
+        elapsed = time.perf_counter() - start
+        with stats.lock:
+            timings, errors, requests = dict(stats.timings), dict(stats.errors), stats.requests
+        stop.set()
+        for user in users:
+            user.join(timeout=30)
+    finally:
+        if server:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+
+    result = {'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'workers': args.workers,
+              'threads': args.threads, 'users': args.users, 'think_s': args.think, 'duration_s': elapsed,
+              'requests': requests, 'requests_per_s': requests / elapsed,
+              'actions_per_s': sum(len(t) for t in timings.values()) / elapsed,
+              'actions': {action: dict(percentiles(t), errors=errors.get(action, 0), callback=stats.callbacks.get(action))
+                          for action, t in sorted(timings.items())},
+              'errors': errors, 'worker_memory_peak': list(peak.values())}
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{result['commit']}-w{args.workers}t{args.threads}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=1)
+
+    print(f"{requests} requests in {elapsed:.0f}s: {result['requests_per_s']:.1f} req/s, "
+          f"{result['actions_per_s']:.1f} user actions/s, {sum(errors.values())} errors")
+    for action, stats in result['actions'].items():
+        print(f"{action:18} {stats['count']:6}  p50 {stats['p50_ms']:7.1f} ms  p95 {stats['p95_ms']:7.1f} ms  "
+              f"p99 {stats['p99_ms']:7.1f} ms  {stats['errors']} errors")
+    for i, worker in enumerate(result['worker_memory_peak']):
+        print(f"worker {i}: rss {worker.get('rss_mb', 0):.0f} MB, pss {worker.get('pss_mb', 0):.0f} MB")
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+# shared data access and helpers used by the dashboard pages
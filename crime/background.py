@@ -0,0 +1,97 @@
+import os
+import time
+
+import diskcache
+import flask
+import psutil
+from dash import DiskcacheManager
+
+from crime.cache import code_version, figure_cache
+from crime.columnar import BUILD_DIR
+from crime.instrument import INSTRUMENT, finish_record, record_callback, start_record
+from crime.store import get_store
+
+# Heavy callbacks (background=True) run in a process of their own instead of the request thread. The
+# browser starts the job, polls for the result every CRIME_BACKGROUND_INTERVAL ms and meanwhile gets the
+# progress. Starting the callback again (another region) kills the job still running for the old input.
+# Results are kept in a diskcache in data/build/callbacks, shared by all gunicorn workers, per data
+# and code version. An identical job that is already running, for another browser, is waited on instead of
+# computed twice. No broker needed, diskcache is sqlite on local disk.
+# A job process ends after one callback, so the figures it builds are written to FIGURE_DIR for the
+# next jobs, unless CRIME_FIGURE_CACHE_DIR already names a directory (see crime/cache.py).
+# With CRIME_INSTRUMENT=1 the job times itself (see crime/instrument.py) and leaves the timings next to
+# its result, the worker that hands out the result records them.
+CALLBACK_DIR = os.path.join(BUILD_DIR, 'callbacks')
+FIGURE_DIR = os.path.join(BUILD_DIR, 'figures')
+BACKGROUND_INTERVAL = int(os.environ.get('CRIME_BACKGROUND_INTERVAL', 200))
+RESULT_EXPIRE = 3600 # seconds a result is kept after it was last used
+CACHE_SIZE = 256 * 1024 ** 2
+JOB_EXPIRE = 600 # a job that claimed a key longer ago than this no longer blocks others
+WAIT_INTERVAL = 0.05
+
+
+def triggered():
+    # the same input values give other outputs depending on which input changed, so the result
+    # cache keys on it too
+    return (flask.request.get_json(silent=True) or {}).get('changedPropIds')
+
+
+class CallbackManager(DiskcacheManager):
+    def make_job_fn(self, fn, progress, key=None):
+        cache = self.handle
+        job = {} # result key of the job this process runs
+
+        def timed_fn(*args):
+            # stored before the result, so whoever gets the result finds them
+            start_record()
+            try:
+                return fn(*args)
+            finally:
+                record = dict(finish_record(), callback=fn.__name__)
+                cache.set(f"{job['key']}-timing", record, expire=RESULT_EXPIRE)
+
+        job_fn = super().make_job_fn(timed_fn if INSTRUMENT else fn, progress, key)
+
+        def dedup_job_fn(result_key, progress_key, args, context):
+            job['key'] = result_key
+            owner = f'{result_key}-owner'
+            # the first job for a key claims it, later ones wait for its result. A claim whose job was
+            # killed (its browser moved on) is taken over
+            while not cache.add(owner, os.getpid(), expire=JOB_EXPIRE):
+                if cache.get(result_key) is not None:
+                    return
+                with cache.transact():
+                    pid = cache.get(owner)
+                    if pid is not None and not self.job_running(pid):
+                        cache.delete(owner)
+                time.sleep(WAIT_INTERVAL)
+            try:
+                if cache.get(result_key) is None:
+                    job_fn(result_key, progress_key, args, context)
+            finally:
+                cache.delete(owner)
+
+        return dedup_job_fn
+
+    def terminate_job(self, job):
+        # a job that finished on its own can exit between dash's pid_exists check and the kill
+        try:
+            super().terminate_job(job)
+        except psutil.NoSuchProcess:
+            pass
+
+    def get_result(self, key, job):
+        result = super().get_result(key, job)
+        if INSTRUMENT and result is not self.UNDEFINED:
+            record = self.handle.pop(f'{key}-timing', None)
+            if record is not None:
+                record_callback(record['callback'], record['seconds'], record, None)
+        return result
+
+
+def background_manager():
+    if not figure_cache.directory:
+        os.makedirs(FIGURE_DIR, exist_ok=True)
+        figure_cache.directory = FIGURE_DIR
+    cache = diskcache.Cache(CALLBACK_DIR, size_limit=CACHE_SIZE)
+    return CallbackManager(cache, cache_by=[lambda: get_store().version, code_version, triggered], expire=RESULT_EXPIRE)
@@ -0,0 +1,35 @@
+import argparse
+import os
+import time
+
+import pandas as pd
+
+from crime.columnar import write_feather, write_geoparquet
+from crime.geo import GEOJSON_PATH, SIMPLIFY_TOLERANCE, build_geometry, read_gemeenten
+from crime.store import CRIME_PATH, META_PATH, POP_PATH, load_store
+
+# Compiles the raw data files into data/build so workers start without parsing csv and geojson:
+#   python -m crime.build
+# The pages fall back to the raw files for every source that changed after the last build.
+
+
+def build(tolerance=SIMPLIFY_TOLERANCE):
+    store = load_store(compiled=False) # the typed table, with Regio, RegioS and Misdaad as categoricals
+    return [
+        write_feather(store.frame, CRIME_PATH),
+        write_feather(pd.read_csv(META_PATH), META_PATH),
+        write_feather(pd.read_csv(POP_PATH), POP_PATH),
+        write_geoparquet(read_gemeenten(compiled=False), GEOJSON_PATH),
+        build_geometry(tolerance=tolerance),
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile the dashboard data into columnar files')
+    parser.add_argument('--tolerance', type=float, default=SIMPLIFY_TOLERANCE,
+                        help='simplify tolerance for the map shapes, in degrees')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    for path in build(args.tolerance):
+        print(f'{path}: {os.path.getsize(path) / 1024:.0f} KB')
+    print(f'done in {time.perf_counter() - start:.1f}s')
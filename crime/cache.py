@@ -0,0 +1,163 @@
+import functools
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import plotly
+import plotly.io as pio
+
+from crime.instrument import count_cache, phase
+
+# Memoized figures. A builder decorated with @memoize_figure is called once per set of arguments, the
+# figure is kept in memory as the plain dict dash sends, so a repeat call does no pandas or plotly work
+# (dash still serializes it per response). With CRIME_FIGURE_CACHE_DIR set its JSON is also written to
+# that directory, where the other workers find it, under the data version it was built from (see
+# crime/ingest.py) so a worker never reads a figure made from older or newer data than its own. The files
+# are keyed by the version of the code as well (code_version), so after a deploy the figures of the old
+# code are not read back.
+FIGURE_CACHE_SIZE = int(os.environ.get('CRIME_FIGURE_CACHE_SIZE', 512))
+FIGURE_CACHE_TTL = float(os.environ.get('CRIME_FIGURE_CACHE_TTL', 3600))
+FIGURE_CACHE_DIR = os.environ.get('CRIME_FIGURE_CACHE_DIR')
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    # hash of the python files that build the figures, and of the plotly that serializes them
+    digest = hashlib.sha1(plotly.__version__.encode())
+    for path in sorted(glob.glob(os.path.join(ROOT, 'crime', '*.py')) + glob.glob(os.path.join(ROOT, 'pages', '*.py'))):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+class FigureCache:
+    def __init__(self, size=FIGURE_CACHE_SIZE, ttl=FIGURE_CACHE_TTL, directory=FIGURE_CACHE_DIR):
+        self.size = size
+        self.ttl = ttl
+        self.directory = directory
+        self.version = ''
+        self.entries = OrderedDict() # key -> (expires, builder, args, figure)
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, builder, args):
+        return hashlib.sha1(repr((builder, args)).encode()).hexdigest()
+
+    def get(self, builder, args):
+        key = self.key(builder, args)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                return entry[3]
+        figure = self.read(key)
+        if figure is None:
+            return None
+        self.remember(key, builder, args, figure)
+        return figure
+
+    def set(self, builder, args, text):
+        figure = json.loads(text)
+        key = self.key(builder, args)
+        self.remember(key, builder, args, figure)
+        self.write(key, builder, args, text)
+        return figure
+
+    def remember(self, key, builder, args, figure):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, builder, args, figure)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def path(self, key):
+        key = hashlib.sha1(f'{code_version()}:{self.version}:{key}'.encode()).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def read(self, key):
+        if not self.directory:
+            return None
+        try:
+            if os.path.getmtime(self.path(key)) + self.ttl < time.time():
+                os.remove(self.path(key))
+                return None
+            with open(self.path(key)) as f:
+                f.readline() # builder and arguments, used by invalidate
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def write(self, key, builder, args, text):
+        if not self.directory:
+            return
+        tmp = f'{self.path(key)}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps([builder, list(args), self.version, code_version()]) + '\n')
+            f.write(text)
+        os.replace(tmp, self.path(key))
+
+    def invalidate(self, builder=None, argument=None):
+        # drop the figures of one builder and/or with one argument (e.g. a region), or all of them
+        def match(name, args):
+            return (builder is None or name == builder) and (argument is None or argument in args)
+
+        with self.lock:
+            for key, (_, name, args, _) in list(self.entries.items()):
+                if match(name, args):
+                    del self.entries[key]
+        self.remove_files(lambda name, args, version: match(name, args) or version != [self.version, code_version()])
+
+    def prune(self):
+        # remove the files written by other code, they are never read again. Run once before the workers
+        # start, see gunicorn.conf.py
+        self.remove_files(lambda name, args, version: version[1:] != [code_version()])
+
+    def remove_files(self, remove):
+        if not self.directory:
+            return
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    name, args, *version = json.loads(f.readline())
+                if remove(name, args, version):
+                    os.remove(path)
+            except (OSError, ValueError):
+                continue
+
+    def set_version(self, version):
+        # after a data refresh. The figures in memory are dropped by invalidate, only those the refresh
+        # touched, while on disk every figure of another version is removed by the next invalidate
+        with self.lock:
+            self.version = version
+
+
+figure_cache = FigureCache()
+
+
+def memoize_figure(func):
+    # the builder returns a plotly figure, the memoized version the same figure as a dict. Hits and
+    # misses are counted on /metrics (count_cache)
+    builder = f'{func.__module__}.{func.__name__}'
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        figure = figure_cache.get(builder, args)
+        count_cache('figure', figure is not None)
+        if figure is None:
+            with phase('figure'):
+                fig = func(*args)
+            with phase('serialize'):
+                figure = figure_cache.set(builder, args, pio.to_json(fig, validate=False))
+        return figure
+
+    wrapper.invalidate = functools.partial(figure_cache.invalidate, builder)
+    return wrapper
@@ -0,0 +1,82 @@
+import argparse
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Reads the crime csv in chunks, keeping only the columns the pages use and typing every chunk as it
+# comes in: text as categoricals, whole numbers as the smallest integer type that holds them and counts
+# as float32 when that keeps every value exactly. Metrics with decimals stay float64, in float32 48.9
+# would show up as 48.900001 in the tables and hover texts. The full CBS export (every region level and
+# year) then never exists as a frame of python strings and float64 columns.
+CHUNK_SIZE = int(os.environ.get('CRIME_CSV_CHUNK_SIZE', 100_000))
+
+TEXT_COLUMNS = ['Regio', 'RegioS', 'Misdaad']
+INTEGER_COLUMNS = ['Perioden', 'CategoryGroupID']
+METRIC_COLUMNS = ['Geregistreerde Misdrijven', 'Geregistreerde Misdrijven Relatief', 'Misdrijven Per 1000 Inw',
+                  'Opgehelderde Misdrijven', 'Opgehelderde Misdrijven Relatief', 'Registraties Van Verdachten',
+                  'BevolkingOp1Januari_1']
+CRIME_COLUMNS = TEXT_COLUMNS + INTEGER_COLUMNS + METRIC_COLUMNS
+
+
+def downcast(chunk):
+    for column in chunk.columns.intersection(INTEGER_COLUMNS):
+        chunk[column] = pd.to_numeric(chunk[column], downcast='integer')
+    for column in chunk.columns.intersection(METRIC_COLUMNS):
+        values = chunk[column].to_numpy(dtype='float64')
+        small = values.astype('float32')
+        if np.array_equal(small, values, equal_nan=True):
+            chunk[column] = small
+    return chunk
+
+
+def widen(frame):
+    # float32 counts back to float64 before computing with them. A ratio of two float32 values is float32
+    # too, and 153.7 in float32 is 153.6999969482422 once it is a python float
+    return frame.astype({column: 'float64' for column, dtype in frame.dtypes.items() if dtype == 'float32'})
+
+
+def read_csv_chunked(path, columns=CRIME_COLUMNS, chunksize=CHUNK_SIZE):
+    # columns missing from the file are skipped. Chunks with a wider type than the others (a count above
+    # 2**24, a year with a missing value) make that column wider in the result
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [column for column in columns if column in header]
+    text = [column for column in TEXT_COLUMNS if column in usecols]
+    reader = pd.read_csv(path, usecols=usecols, dtype={column: 'category' for column in text}, chunksize=chunksize)
+    chunks = [downcast(chunk) for chunk in reader]
+    if not chunks:
+        return pd.read_csv(path, usecols=usecols)
+    # one column at a time, so the chunks are freed while the result is put together. Every chunk has
+    # its own categories, union_categoricals merges them in order of appearance
+    columns = {}
+    for column in usecols:
+        parts = [chunk.pop(column) for chunk in chunks]
+        columns[column] = union_categoricals(parts) if column in text else np.concatenate(parts)
+        del parts
+    return pd.DataFrame(columns, copy=False)
+
+
+if __name__ == '__main__':
+    from crime.store import CRIME_PATH
+
+    parser = argparse.ArgumentParser(description='Read the crime csv in chunks and report the memory it takes')
+    parser.add_argument('path', nargs='?', default=CRIME_PATH)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--compare', action='store_true', help='also read it in one go with pd.read_csv')
+    args = parser.parse_args()
+    readers = [('chunked', lambda: read_csv_chunked(args.path, chunksize=args.chunksize))]
+    if args.compare:
+        readers.append(('read_csv', lambda: pd.read_csv(args.path)))
+    for name, read in readers:
+        tracemalloc.start()
+        start = time.perf_counter()
+        frame = read()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{name}: {len(frame)} rows, {len(frame.columns)} columns in {seconds:.1f}s, '
+              f'frame {frame.memory_usage(deep=True).sum() / 1024 ** 2:.0f} MB, peak {peak / 1024 ** 2:.0f} MB')
+        del frame
@@ -0,0 +1,83 @@
+import json
+import os
+
+import geopandas as gpd
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+    import pyarrow.parquet as parquet
+except ImportError: # without pyarrow the raw csv/geojson files are read
+    feather = None
+
+# Compiled copies of the data files (see crime/build.py). Each copy is listed in the manifest with the
+# size and modification time of its source, a copy whose source changed since is ignored
+BUILD_DIR = 'data/build'
+MANIFEST_PATH = os.path.join(BUILD_DIR, 'manifest.json')
+
+
+def compiled_path(source, suffix):
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(BUILD_DIR, name + suffix)
+
+
+def signature(source):
+    stat = os.stat(source)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record(source, target):
+    manifest = read_manifest()
+    manifest[target] = signature(source)
+    tmp = MANIFEST_PATH + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def is_fresh(source, target):
+    return (feather is not None and os.path.exists(target)
+            and read_manifest().get(target) == signature(source))
+
+
+def write_feather(frame, source):
+    target = compiled_path(source, '.feather')
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    feather.write_feather(frame.reset_index(drop=True), target, compression='uncompressed')
+    record(source, target)
+    return target
+
+
+def read_feather(source, columns=None):
+    # the compiled table, memory mapped, or None when it is missing or stale
+    target = compiled_path(source, '.feather')
+    if not is_fresh(source, target):
+        return None
+    # split blocks lets numeric columns without missing values stay views on the mapped file
+    return feather.read_table(target, columns=columns, memory_map=True).to_pandas(split_blocks=True)
+
+
+def write_geoparquet(frame, source):
+    target = compiled_path(source, '.parquet')
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    frame.to_parquet(target)
+    record(source, target)
+    return target
+
+
+def read_geoparquet(source, geometry=True):
+    target = compiled_path(source, '.parquet')
+    if not is_fresh(source, target):
+        return None
+    if geometry:
+        return gpd.read_parquet(target)
+    columns = [name for name in parquet.read_schema(target).names if name != 'geometry']
+    return pd.read_parquet(target, columns=columns)
@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import flask
+
+try:
+    import brotli
+except ImportError: # without brotli only gzip is offered
+    brotli = None
+
+# Compressed responses. The layout, the callback outputs, the dash scripts and the tiles are compressed
+# with brotli or gzip, whichever the browser prefers (Accept-Encoding). Most of them are the same bytes
+# for every visitor: the page layouts are built once per data version and the figures are memoized (see
+# crime/cache.py), so the compressed bytes are kept by content hash and a repeat costs a hash instead of
+# a compression. Bodies below CRIME_COMPRESS_MIN_SIZE bytes are sent as they are, bodies above
+# CRIME_COMPRESS_CACHE_MAX_SIZE are compressed every time instead of filling the cache.
+COMPRESS_MIN_SIZE = int(os.environ.get('CRIME_COMPRESS_MIN_SIZE', 1024))
+COMPRESS_CACHE_MAX_SIZE = int(os.environ.get('CRIME_COMPRESS_CACHE_MAX_SIZE', 8 * 1024 ** 2))
+# memory for compressed bytes per worker
+COMPRESS_CACHE_BYTES = int(os.environ.get('CRIME_COMPRESS_CACHE_MB', 64)) * 1024 ** 2
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 # 11 compresses a little better but is too slow for callback outputs
+
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip'] # in order of preference
+SUFFIXES = {'br': 'br', 'gzip': 'gz'}
+COMPRESSIBLE = {'application/json', 'application/geo+json', 'application/javascript', 'text/javascript',
+                'text/html', 'text/css', 'text/plain', 'image/svg+xml', 'application/vnd.mapbox-vector-tile'}
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0) # mtime 0, same input same bytes
+
+
+def accepted_encoding():
+    # the encoding of ENCODINGS the browser accepts with the highest quality, None for none
+    return flask.request.accept_encodings.best_match(ENCODINGS)
+
+
+class CompressedCache:
+    # compressed bodies by (content hash, encoding), least recently used go first once over max_bytes
+
+    def __init__(self, max_bytes=COMPRESS_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, data, encoding):
+        if len(data) > COMPRESS_CACHE_MAX_SIZE:
+            return compress(data, encoding)
+        key = (hashlib.sha1(data).digest(), encoding)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        compressed = compress(data, encoding)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = compressed
+                self.size += len(compressed)
+            while self.size > self.max_bytes:
+                self.size -= len(self.entries.popitem(last=False)[1])
+        return compressed
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+compressed_cache = CompressedCache()
+
+
+def precompressed(path):
+    # (file to send, Content-Encoding) for a static file, the compressed copy is written next to it
+    # the first time and again when the file is newer
+    encoding = accepted_encoding()
+    if encoding is None or os.path.getsize(path) < COMPRESS_MIN_SIZE:
+        return path, None
+    target = f'{path}.{SUFFIXES[encoding]}'
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(path):
+        with open(path, 'rb') as f:
+            data = compress(f.read(), encoding)
+        tmp = f'{target}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, target) # other workers see the old copy or the new one, never half of it
+    return target, encoding
+
+
+def register_compression(server):
+    @server.after_request
+    def compress_response(response):
+        response.vary.add('Accept-Encoding')
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE):
+            return response
+        encoding = accepted_encoding()
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compressed_cache.get(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        # a strong etag names the exact bytes, these differ per encoding. Weak etags still match on
+        # If-None-Match, so the 304s keep working
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,217 @@
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import time
+
+from plotly.io.json import to_json_plotly
+
+from crime.columnar import BUILD_DIR
+from crime.compress import ENCODINGS, SUFFIXES, compress
+from crime.geo import GEOMETRY_ROUTE, ensure_geometry
+
+# Static export of the dashboard, for serving it without python:
+#   python -m crime.export                     # writes data/build/export
+#   python -m http.server -d data/build/export # any static file server will do
+# The inputs of the server callbacks are finite: every region of the dropdown times every crime
+# category of the bars, the table levels, the map tabs and the pages. The export renders the outputs
+# for all of them, the regions in parallel over the cores, as JSON files under exported/<kind>/, named
+# after the inputs (key_name). The page layouts, _dash-layout, the dash scripts and the assets are
+# written next to them. In the exported callbacks (_dash-dependencies) the server callbacks are
+# replaced by the clientside ones of assets/static.js, which fetch those files.
+# What needs the server is left out: the map stays at gemeente level when zooming (see crime/lod.py),
+# the gemeente table pages, sorts and filters in the browser with all its rows, and a binned scatter
+# (see crime/scatter.py) doesn't show the single points when zoomed in.
+EXPORT_DIR = os.path.join(BUILD_DIR, 'export')
+DATA_ROUTE = '/exported/'
+FNV_OFFSETS = [0x811c9dc5, 0x050c5d1f]
+FNV_PRIME = 0x01000193
+
+# server callbacks by output, and the function of assets/static.js that replaces them. Those of
+# NATIVE_CALLBACKS are left out, their component does the work in the browser
+STATIC_CALLBACKS = {
+    '.._pages_content.children..._pages_store.data..': 'page',
+    '..map-graph.figure...map-level.data..': 'map',
+    '..line.figure...bars.figure...cards-div.children...crime-table.data...crime-table.tooltip_data...region-job.data..':
+        'region',
+}
+NATIVE_CALLBACKS = {'..gemeente-table.data...gemeente-table.page_count..', 'scatter-graph.figure'}
+# inputs only server callbacks set, never those of assets/static.js. The callbacks on them are left out
+SERVER_INPUTS = {'region-job.data'}
+# the build fingerprint dash puts in the names of the chunks a component package loads later
+CHUNK_FINGERPRINT = re.compile(r'"(v\d+_\d+_\d+\w*?m\d+)"')
+
+
+def key_name(key):
+    # file name of a key, two 32 bit FNV-1a hashes of its JSON. Same as keyName in assets/static.js
+    data = json.dumps(key, ensure_ascii=False, separators=(',', ':')).encode()
+    name = ''
+    for value in FNV_OFFSETS:
+        for byte in data:
+            value = ((value ^ byte) * FNV_PRIME) & 0xffffffff
+        name += f'{value:08x}'
+    return name
+
+
+def write_file(target, data, encodings=()):
+    # and a compressed copy per encoding, for servers that send those as they are (gzip_static)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+    for encoding in encodings:
+        with open(f'{target}.{SUFFIXES[encoding]}', 'wb') as f:
+            f.write(compress(data, encoding))
+    return len(data)
+
+
+def write_output(output, kind, args, value, encodings=()):
+    key = [kind, *args]
+    path = os.path.join(output, DATA_ROUTE.strip('/'), kind, key_name(key) + '.json')
+    return write_file(path, to_json_plotly(value).encode(), encodings)
+
+
+def export_region(task):
+    # every output of update_region and build_region for one region, run in the worker processes
+    output, regio, encodings = task
+    from crime.store import get_store
+    from crime.views import region_table
+    from pages.dashboard_main_page import (TABLE_DEPTHS, create_bar, create_card_crime, create_card_crime_t,
+                                           create_card_pop, create_line)
+    size = count = 0
+    for crime in get_store().top_categories():
+        cards = [create_card_pop(regio), create_card_crime(regio, crime), create_card_crime_t(regio, crime)]
+        size += write_output(output, 'crime', [regio, crime], {'line': create_line(regio, crime), 'cards': cards},
+                             encodings)
+        count += 1
+    size += write_output(output, 'bars', [regio], create_bar(regio), encodings)
+    count += 1
+    for _, depth in TABLE_DEPTHS:
+        size += write_output(output, 'table', [regio, depth], list(region_table(regio, depth)), encodings)
+        count += 1
+    return count, size
+
+
+def static_dependencies(dependencies):
+    # the callbacks of the app, with the server ones swapped for assets/static.js
+    static = []
+    for dependency in dependencies:
+        if dependency['clientside_function'] is not None:
+            static.append(dependency)
+        elif dependency['output'] in STATIC_CALLBACKS:
+            function = {'namespace': 'crime_static', 'function_name': STATIC_CALLBACKS[dependency['output']]}
+            static.append(dict(dependency, clientside_function=function, long=None))
+        elif all(f"{i['id']}.{i['property']}" in SERVER_INPUTS for i in dependency['inputs']):
+            continue
+        elif dependency['output'] not in NATIVE_CALLBACKS:
+            raise ValueError(f"no static version of the callback for {dependency['output']}")
+    return static
+
+
+def static_page(module, layout):
+    # the page as exported, the parts a server callback drives do their work in the browser
+    if module == 'pages.page2':
+        from pages.page2 import datatable_crime_df
+        layout = copy.deepcopy(layout) # the page of the app is cached, see build_layout
+        for component in layout._traverse():
+            if getattr(component, 'id', None) == 'gemeente-table':
+                component.data = datatable_crime_df().to_dict('records')
+                component.page_action = component.sort_action = component.filter_action = 'native'
+                del component.page_count
+    return layout
+
+
+def resource_paths(index):
+    # local scripts, stylesheets and icons of the index page, without their query string
+    return sorted({path.split('?')[0] for path in re.findall(r'(?:src|href)="(/[^"/][^"]*)"', index)})
+
+
+def export_site(app, output, encodings=()):
+    # everything but the callback outputs: index pages, layout, callbacks, scripts, assets and the map shapes
+    import dash
+    client = app.server.test_client()
+    index = client.get('/').get_data(as_text=True)
+    index = index.replace('<head>', f'<head>\n<meta name="crime-static" content="{DATA_ROUTE}">', 1)
+    for page in dash.page_registry.values(): # so a plain file server finds /inzichten too
+        write_file(os.path.join(output, page['path'].strip('/'), 'index.html'), index.encode(), encodings)
+    write_file(os.path.join(output, '_dash-layout.json'), client.get('/_dash-layout').data, encodings)
+    dependencies = static_dependencies(client.get('/_dash-dependencies').get_json())
+    write_file(os.path.join(output, '_dash-dependencies.json'), json.dumps(dependencies).encode(), encodings)
+
+    # the scripts of the index page as they are named there, fingerprint included, and the chunks the
+    # component packages load later under the names their own chunk loader asks for
+    fingerprints = {}
+    for path in resource_paths(index):
+        if path.startswith('/assets/'):
+            continue
+        data = client.get(path).data
+        write_file(os.path.join(output, path.lstrip('/')), data, encodings)
+        if path.startswith('/_dash-component-suites/'):
+            folder = os.path.dirname(path)
+            fingerprints.setdefault(folder, set()).update(CHUNK_FINGERPRINT.findall(data.decode('utf-8', 'ignore')))
+    for package, paths in app.registered_paths.items():
+        for path in paths:
+            if path.endswith('.map'): # source maps, only for the devtools
+                continue
+            response = client.get(f'/_dash-component-suites/{package}/{path}')
+            folder, name = os.path.split(f'/_dash-component-suites/{package}/{path}')
+            for fingerprint in fingerprints.get(folder, ()):
+                parts = name.split('.')
+                parts.insert(1, fingerprint)
+                write_file(os.path.join(output, folder.lstrip('/'), '.'.join(parts)), response.data, encodings)
+    shutil.copytree(app.config.assets_folder, os.path.join(output, 'assets'), dirs_exist_ok=True)
+    with open(ensure_geometry(), 'rb') as f:
+        write_file(os.path.join(output, GEOMETRY_ROUTE.lstrip('/')), f.read(), encodings)
+
+    for page in dash.page_registry.values():
+        layout = static_page(page['module'], page['layout']())
+        write_output(output, 'page', [page['path']], {'layout': layout, 'title': page['title']}, encodings)
+
+
+def export(output=EXPORT_DIR, regions=None, jobs=None, encodings=()):
+    import dashboard
+    import pages.dashboard_main_page as main_page
+    from crime.cache import figure_cache
+    from crime.ingest import refresh
+    from crime.store import get_store
+
+    get_store()
+    refresh() # deltas written since data/Crimefull.csv, see crime/ingest.py
+    figure_cache.directory = None # every figure is built once here, no use keeping them on disk
+    main_page.MAP_SOURCE = 'geojson' # the tile map needs the tile server
+    shutil.rmtree(os.path.join(output, DATA_ROUTE.strip('/')), ignore_errors=True)
+    export_site(dashboard.app, output, encodings)
+    for tab, (param, reverse) in main_page.MAP_METRICS.items():
+        write_output(output, 'map', [tab], main_page.create_map(param, reverse), encodings)
+
+    if regions is None:
+        regions = [option['value'] for option in main_page.region_options()]
+    count = size = 0
+    # forked after the store is loaded, so the workers share it instead of each reading the data
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+        tasks = [(output, regio, encodings) for regio in regions]
+        for files, written in pool.imap_unordered(export_region, tasks):
+            count += files
+            size += written
+
+    store = get_store()
+    manifest = {'version': store.version, 'latest_year': int(store.latest_year), 'created': time.time(),
+                'regions': len(regions), 'files': count, 'bytes': size, 'encodings': list(encodings)}
+    write_file(os.path.join(output, 'manifest.json'), json.dumps(manifest, indent=1).encode())
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the dashboard with every callback output as static files')
+    parser.add_argument('--output', default=EXPORT_DIR, help='directory of the static site')
+    parser.add_argument('--jobs', type=int, default=None, help='processes rendering the regions, default all cores')
+    parser.add_argument('--regions', nargs='*', default=None, help='only these regions, default all')
+    parser.add_argument('--compress', action='store_true', help='also write compressed copies of every file')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    manifest = export(args.output, args.regions, args.jobs, ENCODINGS if args.compress else ())
+    print(f"{args.output}: {manifest['regions']} regions, {manifest['files']} files, "
+          f"{manifest['bytes'] / 1024 ** 2:.1f} MB")
+    print(f'done in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,86 @@
+import argparse
+import hashlib
+import json
+import os
+
+import flask
+import geopandas as gpd
+import shapely
+
+from crime.columnar import BUILD_DIR, read_geoparquet
+from crime.compress import precompressed
+
+GEOJSON_PATH = 'data/dataframe.geojson'
+GEOMETRY_PATH = os.path.join(BUILD_DIR, 'gemeenten.geojson')
+GEOMETRY_ROUTE = '/geo/gemeenten.geojson'
+
+# tolerance in degrees for simplifying the polygons, 0.0005 is roughly 50 metres
+SIMPLIFY_TOLERANCE = float(os.environ.get('CRIME_SIMPLIFY_TOLERANCE', 0.0005))
+# decimals kept in the coordinates, 5 decimals is about a metre
+COORDINATE_DECIMALS = 5
+# the url carries a content hash, so browsers may keep the file for a long time
+GEOMETRY_MAX_AGE = 365 * 24 * 3600
+
+
+def build_geometry(source=GEOJSON_PATH, target=GEOMETRY_PATH, tolerance=SIMPLIFY_TOLERANCE):
+    # writes the gemeente polygons without properties, keyed on statcode, so the map only ships shapes
+    gdf = gpd.read_file(source)
+    geometry = gdf.geometry.simplify(tolerance, preserve_topology=True)
+    geometry = shapely.transform(geometry.to_numpy(), lambda coords: coords.round(COORDINATE_DECIMALS))
+    features = [{"type": "Feature", "id": code, "properties": {}, "geometry": shapely.geometry.mapping(geom)}
+                for code, geom in zip(gdf.statcode, geometry)]
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = target + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, separators=(',', ':'))
+    os.replace(tmp, target) # running workers never see a half written file
+    return target
+
+
+def read_gemeenten(geometry=True, compiled=True):
+    # gemeente properties (and shapes), from the compiled GeoParquet copy when it is up to date
+    frame = read_geoparquet(GEOJSON_PATH, geometry) if compiled else None
+    if frame is None:
+        frame = gpd.read_file(GEOJSON_PATH, ignore_geometry=not geometry)
+    return frame
+
+
+def ensure_geometry():
+    # build the simplified file when it is missing or older than the source
+    if not os.path.exists(GEOMETRY_PATH) or os.path.getmtime(GEOMETRY_PATH) < os.path.getmtime(GEOJSON_PATH):
+        build_geometry()
+    return GEOMETRY_PATH
+
+
+_url = None
+
+
+def geometry_url():
+    # url used as geojson in the map figures, the browser fetches and caches it once
+    global _url
+    if _url is None:
+        with open(ensure_geometry(), 'rb') as f:
+            version = hashlib.sha1(f.read()).hexdigest()[:12]
+        _url = f'{GEOMETRY_ROUTE}?v={version}'
+    return _url
+
+
+def register_geometry_route(server):
+    @server.route(GEOMETRY_ROUTE)
+    def geometry():
+        # compressed once to a file next to it, see crime/compress.py
+        path, encoding = precompressed(os.path.abspath(ensure_geometry()))
+        response = flask.send_file(path, mimetype='application/geo+json',
+                                   etag=True, conditional=True, max_age=GEOMETRY_MAX_AGE)
+        response.cache_control.public = True
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the simplified gemeente geometry used by the map')
+    parser.add_argument('--tolerance', type=float, default=SIMPLIFY_TOLERANCE)
+    args = parser.parse_args()
+    path = build_geometry(tolerance=args.tolerance)
+    print(f'{path}: {os.path.getsize(path) / 1024:.0f} KB')
@@ -0,0 +1,30 @@
+import re
+
+import pandas as pd
+
+# The CBS crime categories form a tree, the depth is the number of digits in the code a title starts with:
+# "Misdrijven, totaal" 0, "1 Vermogensmisdrijven" 1, "11 Diefstal/verduistering en inbraak" 2,
+# "111 Diefstal en inbraak met geweld" 3. Worked out once from data/misdrijf_meta.csv, the pages look
+# categories up in it instead of parsing the titles again.
+CODE = re.compile(r'^[\d.]+(?= )')
+
+
+def title_depth(title):
+    code = CODE.match(title)
+    return sum(char.isdigit() for char in code.group()) if code else 0
+
+
+def category_hierarchy(meta):
+    # one row per category, indexed by title and in metadata order: Key, depth, parent, CategoryGroupID, tooltip
+    depth = meta.Title.map(title_depth)
+    parents = []
+    stack = [] # (depth, title) of the categories above the current one
+    for title, level in zip(meta.Title, depth):
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        parents.append(stack[-1][1] if stack else None)
+        stack.append((level, title))
+    return pd.DataFrame({'Key': meta.Key.to_numpy(), 'depth': depth.to_numpy(dtype='int8'), 'parent': parents,
+                         'CategoryGroupID': meta.CategoryGroupID.to_numpy(),
+                         'tooltip': meta.Description.fillna('').to_numpy()},
+                        index=pd.Index(meta.Title, name='Misdaad'))
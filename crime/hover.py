@@ -0,0 +1,34 @@
+# hover formatting shared by the map and the charts. Values are formatted by plotly.js in the
+# browser through hovertemplates, so no hover strings are built per row in Python
+
+# d3 number format and suffix per column
+HOVER_FORMATS = {
+    'Geregistreerde Misdrijven': (',.0f', ''),
+    'Opgehelderde Misdrijven': (',.0f', ''),
+    'Misdrijven Per 1000 Inw': ('', ''),
+    'Opgehelderde Misdrijven Relatief': ('', '%'),
+}
+
+
+def hover_value(variable, column):
+    # template placeholder for one value, e.g. hover_value('y', 'Geregistreerde Misdrijven') -> '%{y:,.0f}'
+    fmt, suffix = HOVER_FORMATS.get(column, ('', ''))
+    if fmt:
+        return f'%{{{variable}:{fmt}}}{suffix}'
+    return f'%{{{variable}}}{suffix}'
+
+
+def hover_template(columns, title=True):
+    # template reading customdata made by hover_data: the title first (in bold), then one line per column
+    lines = ['<b>%{customdata[0]}</b>'] if title else []
+    offset = len(lines)
+    for i, column in enumerate(columns):
+        lines.append(f'{column} - {hover_value(f"customdata[{i + offset}]", column)}')
+    return '<br>'.join(lines) + '<br>'
+
+
+def hover_data(df, columns, title=None):
+    # customdata array matching hover_template, title is the column holding the name shown on top
+    if title is not None:
+        columns = [title] + list(columns)
+    return df[columns].to_numpy()
@@ -0,0 +1,264 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import crime.store
+from crime.cache import figure_cache
+from crime.columnar import BUILD_DIR
+from crime.store import INDEX, CrimeStore, get_store
+from crime.tiles import gemeente_level, tile_cache
+from crime.trends import yearly_trend
+from crime.views import clear_views
+
+# New CBS data without restarting the workers. An export of table 83648NED (OData json or csv, a file or
+# a directory of them) is compared with the data the dashboard has:
+#   python -m crime.ingest path/to/export
+# and only the (Regio, Perioden, Misdaad) rows that are new or changed are written as a delta to
+# data/build/deltas. Every worker looks for new deltas at most every CRIME_REFRESH_INTERVAL seconds,
+# applies them to a copy of its store, swaps it in and drops only the cached views, figures and tiles
+# of the regions that changed. Applying a delta twice changes nothing, so a restarted worker simply
+# applies all of them again on top of data/Crimefull.csv.
+DELTA_DIR = os.path.join(BUILD_DIR, 'deltas')
+REFRESH_INTERVAL = float(os.environ.get('CRIME_REFRESH_INTERVAL', 30))
+
+VALUE_COLUMNS = ['Geregistreerde Misdrijven', 'Geregistreerde Misdrijven Relatief', 'Misdrijven Per 1000 Inw',
+                 'Opgehelderde Misdrijven', 'Opgehelderde Misdrijven Relatief', 'Registraties Van Verdachten']
+# OData field names (without the _<n> suffix, lower case) -> column names of data/Crimefull.csv
+ODATA_COLUMNS = {
+    'soortmisdrijf': 'Soortmisdrijf',
+    'regios': 'RegioS',
+    'perioden': 'Perioden',
+    'geregistreerdemisdrijven': 'Geregistreerde Misdrijven',
+    'totaalgeregistreerdemisdrijven': 'Geregistreerde Misdrijven',
+    'geregistreerdemisdrijvenrelatief': 'Geregistreerde Misdrijven Relatief',
+    'geregistreerdemisdrijvenper1000inw': 'Misdrijven Per 1000 Inw',
+    'opgehelderdemisdrijven': 'Opgehelderde Misdrijven',
+    'totaalopgehelderdemisdrijven': 'Opgehelderde Misdrijven',
+    'opgehelderdemisdrijvenrelatief': 'Opgehelderde Misdrijven Relatief',
+    'registratiesvanverdachten': 'Registraties Van Verdachten',
+}
+DIMENSIONS = ['RegioS', 'SoortMisdrijf', 'Perioden'] # dimension tables that may come with the export
+
+MAP_COLUMNS = ['Geregistreerde Misdrijven', 'Geregistreerde Misdrijven Relatief', 'Misdrijven Per 1000 Inw',
+               'Opgehelderde Misdrijven', 'Opgehelderde Misdrijven Relatief', 'Registraties Van Verdachten']
+TOTAL = 'Misdrijven, totaal'
+
+
+def read_file(path):
+    if path.endswith('.json'):
+        with open(path) as f:
+            data = json.load(f)
+        return pd.DataFrame(data['value'] if isinstance(data, dict) else data)
+    with open(path) as f:
+        header = f.readline()
+    return pd.read_csv(path, sep=';' if header.count(';') > header.count(',') else ',')
+
+
+def read_export(path):
+    # (data, {dimension: key -> title}) from an export file or directory
+    if not os.path.isdir(path):
+        return read_file(path), {}
+    files = sorted(glob.glob(os.path.join(path, '*.json')) + glob.glob(os.path.join(path, '*.csv')))
+    titles = {}
+    for name in DIMENSIONS:
+        for file in [f for f in files if os.path.splitext(os.path.basename(f))[0] == name]:
+            table = read_file(file)
+            titles[name] = dict(zip(table.Key.astype(str).str.strip(), table.Title))
+            files.remove(file)
+    if not files:
+        raise FileNotFoundError(f'no data files in {path}')
+    return pd.concat([read_file(f) for f in files], ignore_index=True), titles
+
+
+def require(data, columns):
+    # a readable error for an export without some of the columns, instead of a KeyError further on
+    missing = [column for column in columns if column not in data]
+    if missing:
+        raise ValueError(f"the export has no column for {', '.join(missing)} "
+                         f"(columns found: {', '.join(map(str, data.columns))})")
+
+
+def normalize(data, store, titles=None):
+    # the export in the layout of data/Crimefull.csv, with the names the dashboard already uses
+    titles = titles or {}
+    if 'Misdaad' not in data: # OData field names
+        data = data.rename(columns=lambda c: ODATA_COLUMNS.get(re.sub(r'_\d+$', '', c).lower(), c))
+        require(data, ['Soortmisdrijf', 'RegioS', 'Perioden'] + VALUE_COLUMNS)
+        data = data.loc[data.Perioden.astype(str).str.endswith('JJ00')] # years only
+        data = data.assign(Perioden=data.Perioden.str[:4].astype(int))
+        meta = store.meta.assign(Key=store.meta.Key.str.strip())
+        soort = data.Soortmisdrijf.astype(str).str.strip()
+        data = data.assign(Soortmisdrijf=soort,
+                           Misdaad=soort.map(dict(zip(meta.Key, meta.Title))).fillna(
+                               soort.map(titles.get('SoortMisdrijf', {}))),
+                           CategoryGroupID=soort.map(dict(zip(meta.Key, meta.CategoryGroupID))))
+    require(data, ['RegioS', 'Perioden', 'Misdaad', 'CategoryGroupID'] + VALUE_COLUMNS)
+    regios = store.frame[['RegioS', 'Regio']].drop_duplicates('RegioS').astype(str)
+    codes = regios.RegioS.str.strip()
+    key = data.RegioS.astype(str).str.strip()
+    # the padded codes and names of the data files, the dimension table for regions that are new
+    data = data.assign(RegioS=key.map(dict(zip(codes, regios.RegioS))).fillna(key),
+                       Regio=data.get('Regio', key.map(dict(zip(codes, regios.Regio)))))
+    data = data.assign(Regio=data.Regio.fillna(key.map(titles.get('RegioS', {}))))
+    populatie = store.populatie.dropna()
+    data = data.assign(BevolkingOp1Januari_1=data.get('BevolkingOp1Januari_1', data.Regio.map(populatie)),
+                       ID=data.get('ID', np.nan))
+    data = data.dropna(subset=['Regio', 'Misdaad'])
+    return data[store.frame.columns.tolist()].astype({c: 'float64' for c in VALUE_COLUMNS})
+
+
+def positions(store, data):
+    # the row of store.frame holding every row of data, -1 for rows that are new
+    index = pd.MultiIndex.from_frame(store.frame[INDEX])
+    return index.get_indexer(pd.MultiIndex.from_frame(data[INDEX]))
+
+
+def changed_rows(store, data):
+    # rows of data that are new or differ from the store in any value column
+    data = data.drop_duplicates(INDEX, keep='last')
+    rows = positions(store, data)
+    known = rows >= 0
+    old = store.frame[VALUE_COLUMNS].to_numpy(dtype='float64')[rows[known]]
+    new = data.loc[known, VALUE_COLUMNS].to_numpy(dtype='float64')
+    differs = ~((old == new) | (np.isnan(old) & np.isnan(new))).all(axis=1)
+    changed = ~known
+    changed[np.flatnonzero(known)[differs]] = True
+    return data.loc[changed]
+
+
+def apply_changes(store, changes, version):
+    # a new store with the changed rows replaced and the new rows added; the old store stays untouched
+    # for the requests still using it
+    frame = store.frame.copy()
+    rows = positions(store, changes)
+    known = rows >= 0
+    columns = [frame.columns.get_loc(c) for c in VALUE_COLUMNS]
+    frame.iloc[rows[known], columns] = changes.loc[known, VALUE_COLUMNS].to_numpy()
+    frame = pd.concat([frame, changes.loc[~known]], ignore_index=True)
+    return CrimeStore(frame, store.meta, store.populatie.reset_index(), version)
+
+
+class Refresh:
+    # what one applied delta changed, passed to the on_refresh hooks
+    def __init__(self, old, new, changes):
+        self.old = old
+        self.new = new
+        self.changes = changes
+        self.regions = set(changes.Regio.astype(str))
+        self.gemeenten = changes.RegioS.astype(str).str.startswith('GM').any()
+        self.new_year = new.latest_year != old.latest_year
+
+    def gemeente_metrics(self):
+        # map values (latest year, all crimes) of the changed gemeenten, indexed by statcode
+        source = self.new.frame if self.new_year else self.changes
+        rows = source.loc[(source.Perioden == self.new.latest_year) & (source.Misdaad.astype(str) == TOTAL)
+                          & source.RegioS.astype(str).str.startswith('GM')]
+        return rows.set_index(rows.RegioS.astype(str).str.strip())[MAP_COLUMNS]
+
+
+def update_metrics(frame, metrics):
+    # overwrite the map values of a frame with a statcode column, in place
+    rows = frame.statcode.isin(metrics.index)
+    for column in metrics.columns.intersection(frame.columns):
+        frame.loc[rows, column] = frame.loc[rows, 'statcode'].map(metrics[column])
+
+
+refresh_hooks = []
+
+
+def on_refresh(hook):
+    # hook(refresh) is called after every applied delta, pages use it to drop their own cached figures
+    refresh_hooks.append(hook)
+    return hook
+
+
+def invalidate(refresh):
+    figure_cache.set_version(refresh.new.version)
+    if refresh.new_year: # every page shows the latest year
+        clear_views()
+        figure_cache.invalidate()
+    else:
+        clear_views(refresh.regions)
+    if refresh.new_year or 'Nederland' in refresh.regions:
+        yearly_trend.cache_clear()
+    metrics = refresh.gemeente_metrics()
+    if len(metrics):
+        update_metrics(gemeente_level().frame, metrics)
+        tile_cache.clear()
+    for hook in refresh_hooks:
+        hook(refresh)
+
+
+def write_delta(changes):
+    os.makedirs(DELTA_DIR, exist_ok=True)
+    digest = hashlib.sha1(pd.util.hash_pandas_object(changes, index=False).to_numpy().tobytes()).hexdigest()
+    path = os.path.join(DELTA_DIR, f'{time.strftime("%Y%m%d%H%M%S")}-{digest[:8]}.csv')
+    changes.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def pending_deltas(store):
+    # deltas newer than the last one applied, oldest first
+    names = sorted(n for n in os.listdir(DELTA_DIR) if n.endswith('.csv')) if os.path.isdir(DELTA_DIR) else []
+    return [n for n in names if n > store.version]
+
+
+_lock = threading.Lock()
+_checked = 0.0
+
+
+def refresh():
+    # apply new deltas; a request that finds another thread busy with it carries on with the old data
+    global _checked
+    if not _lock.acquire(blocking=False):
+        return []
+    try:
+        _checked = time.monotonic()
+        applied = []
+        for name in pending_deltas(get_store()):
+            old = get_store()
+            delta = normalize(pd.read_csv(os.path.join(DELTA_DIR, name)), old)
+            changes = changed_rows(old, delta)
+            new = apply_changes(old, changes, name)
+            crime.store._store = new
+            invalidate(Refresh(old, new, changes))
+            applied.append(name)
+        return applied
+    finally:
+        _lock.release()
+
+
+def register_refresh(server):
+    # the requests only start the check, the delta is applied next to them on a thread of its own
+    @server.before_request
+    def check_deltas():
+        if time.monotonic() - _checked > REFRESH_INTERVAL and not _lock.locked():
+            threading.Thread(target=refresh, daemon=True).start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the rows of a CBS 83648NED export that differ from the '
+                                                 'dashboard data as a delta the workers pick up')
+    parser.add_argument('export', help='OData json or csv file, or a directory with the data and dimension files')
+    parser.add_argument('--dry-run', action='store_true', help='only report what changed')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    refresh() # compare against the data the workers have, deltas included
+    store = get_store()
+    data, titles = read_export(args.export)
+    delta = normalize(data, store, titles)
+    changes = changed_rows(store, delta)
+    print(f'{len(data)} rows read, {len(delta)} usable, {len(changes)} new or changed '
+          f'in {changes.Regio.nunique()} regions, years {sorted(changes.Perioden.unique().tolist())}')
+    if len(changes) and not args.dry_run:
+        print(f'delta written to {write_delta(changes)}')
+    print(f'done in {time.perf_counter() - start:.1f}s')
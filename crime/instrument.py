@@ -0,0 +1,206 @@
+import contextlib
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+import flask
+
+# Opt-in timing of the dashboard, CRIME_INSTRUMENT=1 turns it on. Every server callback is timed and its
+# wall time split in phases: 'data' (selecting from the store, see crime/views.py and crime/tablequery.py),
+# 'figure' (building plotly figures), 'serialize' (figure and response JSON) and 'other' (the rest of the
+# callback). Output bytes, cache hits and the triggering input are counted too, next to the bytes and time
+# of every HTTP request. /metrics serves it all in the Prometheus text format. Each gunicorn worker
+# counts for itself, the pid label tells them apart.
+# Callbacks slower than CRIME_SLOW_CALLBACK_MS are logged with their input values (a CRIME_SLOW_SAMPLE
+# fraction of them) to the 'crime.slow' logger.
+INSTRUMENT = os.environ.get('CRIME_INSTRUMENT') == '1'
+SLOW_CALLBACK_MS = float(os.environ.get('CRIME_SLOW_CALLBACK_MS', 500))
+SLOW_SAMPLE = float(os.environ.get('CRIME_SLOW_SAMPLE', 0.1))
+METRICS_ROUTE = '/metrics'
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+PHASES = ['data', 'figure', 'serialize', 'other']
+
+slow_log = logging.getLogger('crime.slow')
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = defaultdict(float) # (name, labels) -> value
+        self.histograms = defaultdict(lambda: [0] * (len(BUCKETS) + 2)) # bucket counts, count, then sum
+
+    def add(self, name, value=1, **labels):
+        with _lock:
+            self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name, seconds, **labels):
+        with _lock:
+            histogram = self.histograms[name, tuple(sorted(labels.items()))]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def text(self):
+        def labels(pairs, **extra):
+            pairs = list(pairs) + sorted(extra.items()) + [('pid', os.getpid())]
+            escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+        lines = []
+        with _lock:
+            for (name, pairs), histogram in sorted(self.histograms.items()):
+                if f'# TYPE {name} histogram' not in lines:
+                    lines.append(f'# TYPE {name} histogram')
+                for bound, count in zip(BUCKETS, histogram):
+                    lines.append(f'{name}_bucket{labels(pairs, le=bound)} {count}')
+                lines.append(f'{name}_bucket{labels(pairs, le="+Inf")} {histogram[-2]}')
+                lines.append(f'{name}_count{labels(pairs)} {histogram[-2]}')
+                lines.append(f'{name}_sum{labels(pairs)} {histogram[-1]:.6f}')
+            for (name, pairs), value in sorted(self.counters.items()):
+                if f'# TYPE {name} counter' not in lines:
+                    lines.append(f'# TYPE {name} counter')
+                lines.append(f'{name}{labels(pairs)} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+@contextlib.contextmanager
+def phase(name):
+    # with phase('data'): ... or @phase('data'). Time spent inside counts for this phase only, not for
+    # the phase around it
+    record = getattr(_local, 'record', None)
+    if record is None:
+        yield
+        return
+    now = time.perf_counter()
+    stack = record['stack']
+    record['phases'][stack[-1][0]] += now - stack[-1][1]
+    stack.append((name, now))
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        record['phases'][name] += now - stack.pop()[1]
+        stack[-1] = (stack[-1][0], now)
+
+
+def count_cache(cache, hit):
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record['cache'][cache, 'hit' if hit else 'miss'] += 1
+
+
+def start_record():
+    # timings of what runs next in this thread, until finish_record
+    start = time.perf_counter()
+    _local.record = {'start': start, 'stack': [('other', start)], 'phases': defaultdict(float),
+                     'cache': defaultdict(int)}
+
+
+def finish_record():
+    record, _local.record = _local.record, None
+    end = time.perf_counter()
+    record['phases'][record['stack'][-1][0]] += end - record['stack'][-1][1]
+    record['seconds'] = end - record['start']
+    return record
+
+
+def timed_callback(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start_record()
+        output = None
+        try:
+            output = func(*args, **kwargs)
+            return output
+        finally:
+            record = finish_record()
+            record_callback(name, record['seconds'], record, output)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def record_callback(name, seconds, record, output):
+    body = flask.request.get_json(silent=True) or {}
+    trigger = ','.join(body.get('changedPropIds') or []) or 'initial'
+    size = len(output) if isinstance(output, (str, bytes)) else 0
+    metrics.observe('crime_callback_seconds', seconds, callback=name)
+    for key, value in record['phases'].items():
+        metrics.add('crime_callback_phase_seconds_total', value, callback=name, phase=key)
+    metrics.add('crime_callback_response_bytes_total', size, callback=name)
+    metrics.add('crime_callback_triggers_total', callback=name, trigger=trigger)
+    for (cache, result), value in record['cache'].items():
+        metrics.add('crime_cache_lookups_total', value, callback=name, cache=cache, result=result)
+    if seconds * 1000 >= SLOW_CALLBACK_MS and random.random() < SLOW_SAMPLE:
+        slow_log.warning(json.dumps({
+            'callback': name, 'ms': round(seconds * 1000, 1), 'bytes': size, 'trigger': trigger,
+            'phases_ms': {key: round(value * 1000, 1) for key, value in record['phases'].items()},
+            'inputs': {f"{i['id']}.{i['property']}": i.get('value') for i in body.get('inputs', [])
+                       if isinstance(i, dict)},
+        }, default=str))
+
+
+def instrument_callbacks(app):
+    # dash moves the callbacks of the pages into callback_map on the first request, so this runs then.
+    # Clientside callbacks have no python function and are left out. A background callback only starts
+    # its job or answers a poll in the request, those count as '<name>:poll'. The job itself is timed in
+    # its own process (crime/background.py) and counts under the name of the callback
+    for callback in app.callback_map.values():
+        func = callback.get('callback')
+        if func is not None and not getattr(func, 'instrumented', False):
+            name = func.__name__ + (':poll' if callback.get('long') else '')
+            callback['callback'] = timed_callback(name, func)
+
+
+def register_instrumentation(app):
+    if not INSTRUMENT:
+        return
+    import dash._callback
+    # the response JSON dash builds after the callback returns
+    to_json = dash._callback.to_json
+    dash._callback.to_json = lambda value: _serialize(to_json, value)
+    server = app.server
+    state = {'wrapped': False}
+
+    @server.before_request
+    def start_request():
+        if not state['wrapped']:
+            instrument_callbacks(app)
+            state['wrapped'] = True
+        flask.g.crime_start = time.perf_counter()
+
+    @server.after_request
+    def end_request(response):
+        start = flask.g.pop('crime_start', None)
+        if start is None:
+            return response
+        rule = flask.request.url_rule
+        path = rule.rule if rule is not None else 'unmatched'
+        size = response.content_length
+        if size is None and not response.direct_passthrough:
+            size = len(response.get_data())
+        metrics.add('crime_http_requests_total', path=path, status=response.status_code)
+        metrics.add('crime_http_response_bytes_total', size or 0, path=path)
+        metrics.observe('crime_http_request_seconds', time.perf_counter() - start, path=path)
+        return response
+
+    @server.route(METRICS_ROUTE)
+    def prometheus_metrics():
+        return flask.Response(metrics.text(), mimetype='text/plain; version=0.0.4')
+
+
+def _serialize(to_json, value):
+    with phase('serialize'):
+        return to_json(value)
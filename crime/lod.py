@@ -0,0 +1,93 @@
+import math
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from crime.instrument import phase
+
+# Finer map levels on top of the gemeente shapes. A level is used once the map is zoomed in past its
+# minimum zoom and the visible area holds at most MAX_FEATURES of its polygons, and only the polygons
+# inside the visible area are sent. The files need the same properties as data/dataframe.geojson
+# (statcode, statnaam and the crime columns); levels without a file are skipped, so the map stays at
+# gemeente level.
+LEVELS = [
+    # (name, path, minimum zoom, simplify tolerance in degrees)
+    ('wijken', 'data/wijken.geojson', 9, 0.0001),
+    ('buurten', 'data/buurten.geojson', 11.5, 0.00002),
+]
+# upper bound on polygons in one view, protects the browser when the level is too fine for the zoom. A
+# view with more polygons gets the next coarser level
+MAX_FEATURES = 5000
+# viewport size assumed when the map did not report its corners
+VIEWPORT_PX = (800, 600)
+
+
+class MapLevel:
+    def __init__(self, name, frame, min_zoom):
+        self.name = name
+        self.frame = frame.reset_index(drop=True)
+        self.min_zoom = min_zoom
+        self.tree = shapely.STRtree(self.frame.geometry.to_numpy())
+
+    @phase('data')
+    def query(self, bbox, limit=None):
+        # polygons intersecting (min lon, min lat, max lon, max lat), in file order. None when there are
+        # more than limit
+        found = self.tree.query(shapely.box(*bbox), predicate='intersects')
+        if limit is not None and len(found) > limit:
+            return None
+        return self.frame.iloc[np.sort(found)]
+
+
+def load_level(name, path, min_zoom, tolerance):
+    frame = gpd.read_file(path).to_crs(epsg=4326)
+    frame['geometry'] = frame.geometry.simplify(tolerance, preserve_topology=True)
+    return MapLevel(name, frame, min_zoom)
+
+
+_levels = None
+
+
+def get_levels():
+    global _levels
+    if _levels is None:
+        _levels = [load_level(*level) for level in LEVELS if os.path.exists(level[1])]
+    return _levels
+
+
+def level_for_view(zoom, bbox):
+    # finest level available at this zoom with at most MAX_FEATURES polygons in the view, and those
+    # polygons. (None, None) means the gemeente shapes
+    for level in reversed(get_levels()):
+        if zoom >= level.min_zoom:
+            frame = level.query(bbox, MAX_FEATURES)
+            if frame is not None:
+                return level, frame
+    return None, None
+
+
+def view_from_relayout(relayout):
+    # (zoom, bbox) from the relayoutData of a mapbox figure, None when the event is not a map move
+    if not relayout or 'mapbox.zoom' not in relayout:
+        return None
+    zoom = relayout['mapbox.zoom']
+    corners = relayout.get('mapbox._derived', {}).get('coordinates')
+    if corners:
+        lons, lats = zip(*corners)
+        return zoom, (min(lons), min(lats), max(lons), max(lats))
+    center = relayout['mapbox.center']
+    # mapbox draws the world 512 px wide at zoom 0
+    width = 360 * VIEWPORT_PX[0] / (512 * 2 ** zoom)
+    height = width * VIEWPORT_PX[1] / VIEWPORT_PX[0] * math.cos(math.radians(center['lat']))
+    return zoom, (center['lon'] - width / 2, center['lat'] - height / 2,
+                  center['lon'] + width / 2, center['lat'] + height / 2)
+
+
+def features_geojson(frame, decimals=5):
+    # inline FeatureCollection keyed on statcode, for the visible part of a finer level
+    geometry = shapely.transform(frame.geometry.to_numpy(), lambda coords: coords.round(decimals))
+    return {"type": "FeatureCollection",
+            "features": [{"type": "Feature", "id": code, "properties": {}, "geometry": shapely.geometry.mapping(geom)}
+                         for code, geom in zip(frame.statcode, geometry)]}
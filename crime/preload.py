@@ -0,0 +1,28 @@
+import os
+
+import dash
+
+from crime.ingest import refresh
+from crime.lod import get_levels
+from crime.store import get_store
+from crime.views import region_view
+
+# regions whose main page data is built before the workers fork, comma separated
+WARM_REGIONS = os.environ.get('CRIME_WARM_REGIONS', 'Nederland')
+
+
+def warm_up(app):
+    # Builds everything a worker would otherwise build on its first requests, so that with
+    # gunicorn's preload_app the workers inherit it from the master instead of each making a copy
+    get_store()
+    refresh() # deltas written since data/Crimefull.csv, see crime/ingest.py
+    get_levels()
+    for regio in filter(None, WARM_REGIONS.split(',')):
+        region_view(regio.strip())
+    client = app.server.test_client()
+    # the first request sets up dash (scripts, callback map, page registry)
+    for path in ['/', '/_dash-layout', '/_dash-dependencies']:
+        client.get(path)
+    # the pages are built when they are first opened, here that is before the fork
+    for page in dash.page_registry.values():
+        page['layout']()
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+
+# Scatter plots that stay fast with many points. Up to SCATTER_SVG_POINTS points are drawn as svg, more
+# with WebGL (scattergl). When more than SCATTER_MAX_POINTS points are in view they are binned on the
+# server in a square grid, every filled cell is drawn as one marker at the mean of its points, sized and
+# colored by how many there are. Zooming in (relayoutData) sends the points of the zoomed area itself
+# once they fit, so neither the payload nor the browser's drawing grows with the data. The figure says
+# in layout.meta whether it is binned, so the browser only sends zooms to the server when it is.
+SCATTER_SVG_POINTS = int(os.environ.get('CRIME_SCATTER_SVG_POINTS', 1000))
+SCATTER_MAX_POINTS = int(os.environ.get('CRIME_SCATTER_MAX_POINTS', 5000))
+SCATTER_BINS = max(int(SCATTER_MAX_POINTS ** 0.5), 1) # so the binned markers are never more than SCATTER_MAX_POINTS
+COLOR = '#636efa' # first color of the plotly template, as px.scatter draws it
+
+FULL_VIEW = (None, None)
+
+
+def axis_view(relayout):
+    # ((x0, x1), (y0, y1)) after a zoom or pan, None for an axis that shows everything. FULL_VIEW when
+    # zoomed out, None when the event doesn't change the axes
+    if not relayout:
+        return None
+    if relayout.get('xaxis.autorange') or relayout.get('yaxis.autorange'):
+        return FULL_VIEW
+    view = []
+    for axis in ['xaxis', 'yaxis']:
+        bounds = relayout.get(f'{axis}.range') or [relayout.get(f'{axis}.range[0]'), relayout.get(f'{axis}.range[1]')]
+        view.append(tuple(sorted(bounds)) if None not in bounds else None)
+    return tuple(view) if view != [None, None] else None
+
+
+def in_view(x, y, view):
+    mask = np.isfinite(x) & np.isfinite(y)
+    for values, bounds in zip((x, y), view):
+        if bounds is not None:
+            mask &= (values >= bounds[0]) & (values <= bounds[1])
+    return mask
+
+
+def binned(x, y, bins=SCATTER_BINS):
+    # (x, y, count) of every filled cell, x and y the mean of the points in it
+    counts, xedges, yedges = np.histogram2d(x, y, bins=bins)
+    xsum = np.histogram2d(x, y, bins=[xedges, yedges], weights=x)[0]
+    ysum = np.histogram2d(x, y, bins=[xedges, yedges], weights=y)[0]
+    filled = counts > 0
+    return xsum[filled] / counts[filled], ysum[filled] / counts[filled], counts[filled].astype(int)
+
+
+def scatter_trace(frame, x, y, name, labels=None, view=FULL_VIEW, unit='punten'):
+    # the points of frame in view, one per row or binned, as a plotly trace
+    labels = labels or {}
+    xlabel, ylabel = labels.get(x, x), labels.get(y, y)
+    xs, ys = frame[x].to_numpy(dtype='float64'), frame[y].to_numpy(dtype='float64')
+    mask = in_view(xs, ys, view)
+    if mask.sum() > SCATTER_MAX_POINTS:
+        bx, by, counts = binned(xs[mask], ys[mask])
+        return go.Scattergl(x=bx, y=by, mode='markers', customdata=counts, name='',
+                            marker=dict(size=np.clip(4 + 2 * np.log2(counts), 4, 20), color=np.log10(counts),
+                                        colorscale='Blues', cmin=-0.5, line=dict(width=0)),
+                            hovertemplate=f'%{{customdata}} {unit}<br>{xlabel} ≈ %{{x:,.0f}}<br>'
+                                          f'{ylabel} ≈ %{{y:,.1f}}<extra></extra>')
+    trace = go.Scattergl if mask.sum() > SCATTER_SVG_POINTS else go.Scatter
+    return trace(x=xs[mask], y=ys[mask], mode='markers', hovertext=frame[name].to_numpy()[mask], name='',
+                 marker=dict(color=COLOR),
+                 hovertemplate=f'<b>%{{hovertext}}</b><br><br>{xlabel}=%{{x}}<br>{ylabel}=%{{y}}<extra></extra>')
+
+
+def scatter_figure(frame, x, y, name, labels=None, unit='punten'):
+    labels = labels or {}
+    fig = go.Figure(scatter_trace(frame, x, y, name, labels, unit=unit))
+    points = in_view(frame[x].to_numpy(dtype='float64'), frame[y].to_numpy(dtype='float64'), FULL_VIEW).sum()
+    # uirevision keeps the zoom when a callback replaces the points
+    fig.update_layout(xaxis_title=labels.get(x, x), yaxis_title=labels.get(y, y), showlegend=False,
+                      uirevision='scatter', margin={"t": 60}, meta={'binned': bool(points > SCATTER_MAX_POINTS)})
+    return fig
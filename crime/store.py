@@ -0,0 +1,85 @@
+import pandas as pd
+
+from crime.chunked import read_csv_chunked, widen
+from crime.columnar import read_feather
+from crime.hierarchy import category_hierarchy
+
+# paths are relative to the project root, like everywhere else in the dashboard
+CRIME_PATH = 'data/Crimefull.csv'
+META_PATH = 'data/misdrijf_meta.csv'
+POP_PATH = 'data/pop.csv'
+
+INDEX = ['Regio', 'Perioden', 'Misdaad']
+
+
+def complete_year(crime):
+    # the latest year with rows for every region that has rows the year before. A delta that brings a
+    # new year for only some regions (see crime/ingest.py) doesn't make it the year the pages show until
+    # the other regions have it too, CBS tables have rows for every region in every year
+    present = crime.groupby(['Regio', 'Perioden'], observed=True).size().unstack(fill_value=0) > 0
+    years = present.columns.sort_values()
+    for year, before in zip(years[::-1], years[::-1][1:]):
+        if (present[year] | ~present[before]).all():
+            return int(year)
+    return int(years[0])
+
+
+class CrimeStore:
+    # holds the crime table once per process. The flat frame is kept for whole-table
+    # selections, the indexed frame is sorted on (Regio, Perioden, Misdaad) so lookups
+    # are binary searches instead of boolean masks over every row
+
+    def __init__(self, crime, meta, populatie, version=''):
+        self.meta = meta
+        self.hierarchy = category_hierarchy(meta) # depth, parent and tooltip per Misdaad
+        self.version = version # name of the last delta applied by crime/ingest.py, '' for the data files
+        # categories follow the order of the metadata so sorting keeps the CBS hierarchy order. The
+        # columns may already be categoricals (compiled or chunked reads) with sorted categories, which
+        # astype would keep, so they are recoded
+        crimes = pd.unique(pd.concat([meta.Title, pd.Series(pd.unique(crime.Misdaad).astype(str))], ignore_index=True))
+        crime = crime.assign(Regio=pd.Categorical(crime.Regio, categories=pd.unique(crime.Regio).astype(str)),
+                             RegioS=crime.RegioS.astype('category'),
+                             Misdaad=pd.Categorical(crime.Misdaad, categories=crimes))
+        self.frame = crime
+        self.indexed = crime.set_index(INDEX).sort_index()
+        self.populatie = populatie.set_index('Regio')['Populatie']
+        self.latest_year = complete_year(crime)
+
+    def region(self, regio):
+        # all years and crime categories of one region, indexed by (Perioden, Misdaad), in float64
+        return widen(self.indexed.loc[regio])
+
+    def population(self, regio):
+        pop = self.populatie.get(regio)
+        if pd.isna(pop):
+            return None
+        return pop
+
+    def top_categories(self):
+        # the first category of every CategoryGroupID is the main category, the first one is the total
+        return self.meta.drop_duplicates(subset=['CategoryGroupID']).Title.tolist()
+
+
+def read_table(path, read_csv=pd.read_csv, compiled=True):
+    # the compiled copy made by crime/build.py when it is up to date, the csv otherwise
+    frame = read_feather(path) if compiled else None
+    if frame is None:
+        frame = read_csv(path)
+    return frame
+
+
+def load_store(compiled=True):
+    # the crime csv is read in typed chunks of only the columns the pages use, see crime/chunked.py
+    return CrimeStore(read_table(CRIME_PATH, read_csv_chunked, compiled),
+                      read_table(META_PATH, compiled=compiled), read_table(POP_PATH, compiled=compiled))
+
+
+_store = None
+
+
+def get_store():
+    # the table is read the first time any page asks for it, every later call shares that copy
+    global _store
+    if _store is None:
+        _store = load_store()
+    return _store
@@ -0,0 +1,103 @@
+import re
+
+import pandas as pd
+
+from crime.instrument import phase
+
+# Filtering, sorting and paging for DataTables with page_action, sort_action and filter_action set
+# to 'custom'. filter_query uses the DataTable syntax, e.g. "{Regio} icontains ams && {2022} > 50".
+
+# operator aliases -> comparison; the i/s prefixes pick case insensitive/sensitive text matching
+OPERATORS = {
+    '=': 'eq', 'eq': 'eq', '!=': 'ne', 'ne': 'ne',
+    '<': 'lt', 'lt': 'lt', '<=': 'le', 'le': 'le',
+    '>': 'gt', 'gt': 'gt', '>=': 'ge', 'ge': 'ge',
+    'contains': 'contains', 'datestartswith': 'datestartswith',
+}
+PART = re.compile(r'^\s*\{(?P<column>[^}]+)\}\s+(?P<operator>\S+)\s*(?P<value>.*?)\s*$')
+
+
+class FilterError(ValueError):
+    pass
+
+
+def parse_value(text):
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '"\'`':
+        return text[1:-1]
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def parse_filter(filter_query):
+    # [(column, operator, value, case_sensitive)] for every "&&" separated part
+    parts = []
+    for part in filter(None, (filter_query or '').split(' && ')):
+        match = PART.match(part)
+        if match is None:
+            raise FilterError(part)
+        column, operator, value = match.group('column', 'operator', 'value')
+        if operator == 'is':
+            parts.append((column, value, None, False)) # "is blank", "is not blank"
+            continue
+        case_sensitive = None
+        if operator[0] in 'is' and operator[1:] in OPERATORS and operator not in OPERATORS:
+            case_sensitive, operator = operator[0] == 's', operator[1:]
+        if operator not in OPERATORS or not value:
+            raise FilterError(part)
+        parts.append((column, OPERATORS[operator], parse_value(value), case_sensitive))
+    return parts
+
+
+def predicate(series, operator, value, case_sensitive):
+    if operator in ('blank', 'nil'):
+        return series.isna() | (series.astype(str).str.strip() == '')
+    if operator in ('not blank', 'not nil'):
+        return series.notna() & (series.astype(str).str.strip() != '')
+    text_operator = operator in ('contains', 'datestartswith')
+    if pd.api.types.is_numeric_dtype(series) and isinstance(value, float) and not text_operator:
+        return getattr(series, operator)(value)
+    # everything else compares as text, whole numbers without the '.0' so "contains 57" finds 57.3
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text, value = series.astype(str), str(value)
+    if not case_sensitive:
+        text, value = text.str.lower(), value.lower()
+    if operator == 'contains':
+        return text.str.contains(value, regex=False)
+    if operator == 'datestartswith':
+        return text.str.startswith(value)
+    return getattr(text, operator)(value)
+
+
+def filter_frame(df, filter_query, case_sensitive=False):
+    mask = pd.Series(True, index=df.index)
+    for column, operator, value, case in parse_filter(filter_query):
+        if column not in df:
+            raise FilterError(column)
+        mask &= predicate(df[column], operator, value, case_sensitive if case is None else case)
+    return df.loc[mask]
+
+
+def sort_frame(df, sort_by):
+    if not sort_by:
+        return df
+    columns = [sort['column_id'] for sort in sort_by]
+    ascending = [sort['direction'] == 'asc' for sort in sort_by]
+    # text sorts without regard to case, like the table does natively
+    key = lambda column: column.str.lower() if column.dtype == object else column
+    return df.sort_values(columns, ascending=ascending, key=key, na_position='last')
+
+
+@phase('data')
+def query_page(df, page_current, page_size, sort_by=None, filter_query=None, case_sensitive=False):
+    # (records of the requested page, number of pages)
+    try:
+        df = filter_frame(df, filter_query, case_sensitive)
+    except FilterError:
+        df = df.iloc[:0] # an unfinished or invalid filter shows no rows, like the native table
+    df = sort_frame(df, sort_by)
+    page_count = max(1, -(-len(df) // page_size))
+    start = (page_current or 0) * page_size
+    return df.iloc[start:start + page_size].to_dict('records'), page_count
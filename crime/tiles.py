@@ -0,0 +1,295 @@
+import math
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import flask
+import numpy as np
+import pandas as pd
+import shapely
+from plotly.colors import sample_colorscale
+
+from crime.columnar import BUILD_DIR
+from crime.geo import read_gemeenten
+from crime.lod import MapLevel, features_geojson, level_for_view
+from crime.store import get_store
+
+# Map tiles cut from the same shapes as the map. /tiles/{z}/{x}/{y}.pbf returns a Mapbox vector tile,
+# .geojson the same features as GeoJSON. Below the first finer level (see crime/lod.py) the tiles hold
+# gemeenten, above it the finer level for that zoom. Plotly can only give a tile layer one color, so
+# the map asks for one layer per color class: ?color=<column>&bins=<n>&klasse=<k> keeps only the
+# features whose value falls in class k.
+TILE_ROUTE = '/tiles/<int:z>/<int:x>/<int:y>.<fmt>'
+TILE_LAYER = 'regio'
+EXTENT = 4096
+BUFFER = 64 # extra pixels around a tile so polygon edges don't show at tile borders
+PROPERTIES = ['statcode', 'statnaam', 'Geregistreerde Misdrijven', 'Misdrijven Per 1000 Inw',
+              'Opgehelderde Misdrijven Relatief']
+TILE_BINS = 8
+TILE_MAX_BINS = 32 # bins and klasse are part of the cache key, so they are kept to a few values
+
+TILE_CACHE_SIZE = 2048 # tiles kept in memory
+TILE_DIR = os.path.join(BUILD_DIR, 'tiles')
+TILE_DISK_LIMIT = 200 * 1024 ** 2 # bytes of tiles kept on disk, oldest are removed first
+TILE_MAX_AGE = 24 * 3600
+
+
+_gemeenten = None
+
+
+def gemeente_level():
+    global _gemeenten
+    if _gemeenten is None:
+        _gemeenten = MapLevel('gemeenten', read_gemeenten(), 0)
+    return _gemeenten
+
+
+def gemeente_points():
+    # a point inside every gemeente, used to show hover text and the colorbar on top of the tiles
+    frame = gemeente_level().frame
+    points = shapely.point_on_surface(frame.geometry.to_numpy())
+    return pd.DataFrame({'statcode': frame.statcode, 'lon': shapely.get_x(points), 'lat': shapely.get_y(points)})
+
+
+def tile_bounds(z, x, y):
+    # (min lon, min lat, max lon, max lat) of a web mercator tile
+    n = 2 ** z
+    lat = lambda row: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def class_filter(frame, column, bins, klasse):
+    # rows in color class klasse when the column is split in bins equal-count classes
+    classes = pd.qcut(frame[column].rank(method='first'), bins, labels=False)
+    return classes == klasse
+
+
+# minimal Mapbox vector tile (protobuf) encoding, polygons only
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _message(number, data):
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+def _uint(number, value):
+    return _varint(number << 3) + _varint(value)
+
+
+def _packed(number, values):
+    return _message(number, b''.join(_varint(v) for v in values))
+
+
+def _value(value):
+    if isinstance(value, str):
+        return _message(1, value.encode())
+    return _varint(3 << 3 | 1) + struct.pack('<d', value) # double_value
+
+
+def _ring(coords, exterior, cursor):
+    # MoveTo, LineTo and ClosePath commands for one ring. Exterior rings have a positive area in tile
+    # coordinates (y down), holes a negative one
+    points = coords[:-1]
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(np.diff(points, axis=0) != 0, axis=1)
+    points = points[keep]
+    if len(points) < 3:
+        return []
+    x, y = points[:, 0], points[:, 1]
+    area = np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)
+    if area == 0:
+        return []
+    if (area > 0) != exterior:
+        points = points[::-1]
+    deltas = np.diff(np.vstack([cursor, points]), axis=0)
+    cursor[:] = points[-1]
+    commands = [1 | 1 << 3, _zigzag(int(deltas[0, 0])), _zigzag(int(deltas[0, 1])), 2 | (len(points) - 1) << 3]
+    for dx, dy in deltas[1:]:
+        commands += [_zigzag(int(dx)), _zigzag(int(dy))]
+    return commands + [7 | 1 << 3]
+
+
+def _polygon_commands(geometry, cursor):
+    commands = []
+    for polygon in getattr(geometry, 'geoms', [geometry]):
+        if polygon.geom_type != 'Polygon':
+            continue
+        outer = _ring(np.asarray(polygon.exterior.coords), True, cursor)
+        if not outer:
+            continue
+        commands += outer
+        for interior in polygon.interiors:
+            commands += _ring(np.asarray(interior.coords), False, cursor)
+    return commands
+
+
+def encode_tile(frame, z, x, y):
+    n = 2 ** z
+
+    def project(coords):
+        lon, lat = coords[:, 0], np.radians(coords[:, 1])
+        px = ((lon + 180) / 360 * n - x) * EXTENT
+        py = ((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * n - y) * EXTENT
+        return np.round(np.column_stack([px, py]))
+
+    keys = [column for column in PROPERTIES if column in frame]
+    values, value_index, features = [], {}, []
+    for i, (row, geometry) in enumerate(zip(frame[keys].itertuples(index=False), shapely.transform(frame.geometry.to_numpy(), project))):
+        commands = _polygon_commands(geometry, np.zeros(2))
+        if not commands:
+            continue
+        tags = []
+        for key, value in enumerate(row):
+            if isinstance(value, float) and math.isnan(value):
+                continue
+            value = value if isinstance(value, str) else float(value)
+            if value not in value_index:
+                value_index[value] = len(values)
+                values.append(value)
+            tags += [key, value_index[value]]
+        features.append(_message(2, _uint(1, i + 1) + _packed(2, tags) + _uint(3, 3) + _packed(4, commands)))
+    if not features:
+        return b''
+    layer = (_uint(15, 2) + _message(1, TILE_LAYER.encode()) + b''.join(features)
+             + b''.join(_message(3, key.encode()) for key in keys)
+             + b''.join(_message(4, _value(value)) for value in values) + _uint(5, EXTENT))
+    return _message(3, layer)
+
+
+def cut_tile(z, x, y, fmt='pbf', color=None, bins=TILE_BINS, klasse=None):
+    west, south, east, north = tile_bounds(z, x, y)
+    pad_x, pad_y = (east - west) * BUFFER / EXTENT, (north - south) * BUFFER / EXTENT
+    bbox = (west - pad_x, south - pad_y, east + pad_x, north + pad_y)
+    level, frame = level_for_view(z, bbox)
+    if level is None:
+        level = gemeente_level()
+        frame = level.query(bbox)
+    frame = frame.copy()
+    if color is not None and klasse is not None:
+        # classes are taken over the whole level so every tile uses the same class bounds
+        frame = frame.loc[class_filter(level.frame, color, bins, klasse).loc[frame.index]]
+    frame['geometry'] = shapely.clip_by_rect(frame.geometry.to_numpy(), *bbox)
+    frame = frame.loc[~frame.geometry.is_empty]
+    if fmt == 'geojson':
+        return flask.json.dumps(features_geojson(frame)).encode()
+    return encode_tile(frame, z, x, y)
+
+
+class TileCache:
+    # tiles in memory (LRU) with a copy on disk shared by all workers, the disk copy is trimmed
+    # to TILE_DISK_LIMIT by removing the least recently written tiles
+
+    def __init__(self, directory=TILE_DIR, size=TILE_CACHE_SIZE, disk_limit=TILE_DISK_LIMIT):
+        self.directory = directory
+        self.size = size
+        self.disk_limit = disk_limit
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+        self.written = 0
+
+    def get(self, key, build):
+        with self.lock:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+                return self.tiles[key]
+        path = os.path.join(self.directory, *key)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+        else:
+            data = build()
+            self.write(path, data)
+        with self.lock:
+            self.tiles[key] = data
+            while len(self.tiles) > self.size:
+                self.tiles.popitem(last=False)
+        return data
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.written += len(data)
+        if self.written > self.disk_limit // 10:
+            self.written = 0
+            self.trim()
+
+    def trim(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_limit:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                try:
+                    os.remove(os.path.join(root, name))
+                except FileNotFoundError: # removed by another worker
+                    pass
+
+
+tile_cache = TileCache()
+
+
+def tile_url(color, klasse, bins=TILE_BINS):
+    # v only makes browsers fetch the tiles again after a data refresh (see crime/ingest.py)
+    return f'/tiles/{{z}}/{{x}}/{{y}}.pbf?color={color}&bins={bins}&klasse={klasse}&v={get_store().version}'
+
+
+def tile_layers(color, colorscale, bins=TILE_BINS, opacity=0.8):
+    # mapbox layers drawing the tiles, one fill layer per color class
+    colors = sample_colorscale(colorscale, [(k + 0.5) / bins for k in range(bins)])
+    return [dict(sourcetype='vector', source=[tile_url(color, k, bins)], sourcelayer=TILE_LAYER,
+                 type='fill', color=colors[k], opacity=opacity, below='traces')
+            for k in range(bins)]
+
+
+def register_tile_route(server):
+    @server.route(TILE_ROUTE)
+    def tile(z, x, y, fmt):
+        if fmt not in ('pbf', 'geojson') or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+            flask.abort(404)
+        args = flask.request.args
+        color = args.get('color')
+        if color is not None and color not in PROPERTIES[2:]:
+            flask.abort(400)
+        bins = args.get('bins', TILE_BINS, type=int)
+        klasse = args.get('klasse', type=int)
+        if not 1 <= bins <= TILE_MAX_BINS or klasse is not None and not 0 <= klasse < bins:
+            flask.abort(400)
+        layer = 'all' if color is None or klasse is None else f'{color}-{bins}-{klasse}'.replace(' ', '_')
+        key = (get_store().version or 'data', layer, str(z), str(x), f'{y}.{fmt}')
+        data = tile_cache.get(key, lambda: cut_tile(z, x, y, fmt, color, bins, klasse))
+        mimetype = 'application/vnd.mapbox-vector-tile' if fmt == 'pbf' else 'application/geo+json'
+        response = flask.Response(data, mimetype=mimetype)
+        response.cache_control.public = True
+        response.cache_control.max_age = TILE_MAX_AGE
+        return response
@@ -0,0 +1,58 @@
+import functools
+
+import numpy as np
+import pandas as pd
+
+from crime.store import get_store
+
+# Yearly Nederland figures per main crime category for the /inzichten charts. For every parameter the
+# change between every pair of years is computed once, the slider callbacks only slice it.
+PARAMETERS = ['Geregistreerde Misdrijven', 'Opgehelderde Misdrijven Relatief']
+# parameters that are compared as a difference (percentage points) instead of as a percentage
+DIFFERENCE = {'Opgehelderde Misdrijven Relatief'}
+
+
+def crimes_per_year(parameter):
+    store = get_store()
+    df = store.indexed.loc["Nederland", parameter].unstack(1)
+    # total and main categories only, ordered by name like the line names in pages/page2.py expect
+    df = df[store.top_categories()]
+    df.columns = df.columns.astype(str)
+    return df.sort_index(axis=1)
+
+
+class YearlyTrend:
+    def __init__(self, parameter):
+        df = crimes_per_year(parameter)
+        self.parameter = parameter
+        self.years = df.index.to_numpy()
+        self.categories = df.columns
+        self.values = df.to_numpy(dtype='float64') # counts may be float32, see crime/chunked.py
+        # change[i, j, k]: category k in year j compared to year i
+        if parameter in DIFFERENCE:
+            self.change = np.round(self.values[None, :, :] - self.values[:, None, :], 2)
+        else:
+            self.change = np.round(self.values[None, :, :] / self.values[:, None, :] * 100, 1)
+
+    def position(self, year):
+        return int(np.searchsorted(self.years, year))
+
+    def between(self, year1, year2):
+        # change from year1 to year2 per category
+        return pd.Series(self.change[self.position(year1), self.position(year2)], index=self.categories)
+
+    def development(self, year1, year2):
+        # yearly values from year1 up to year2, as percentage of year1 unless compared as difference
+        i, j = self.position(year1), self.position(year2) + 1
+        values = self.values[i:j] if self.parameter in DIFFERENCE else self.change[i, i:j]
+        return pd.DataFrame(values, index=pd.Index(self.years[i:j], name='Perioden'), columns=self.categories)
+
+    def to_store(self):
+        # the trend as sent to the browser, where assets/inzichten.js slices it for the slider charts
+        return {'years': self.years.tolist(), 'difference': self.parameter in DIFFERENCE,
+                'values': self.values.tolist(), 'change': self.change.tolist()}
+
+
+@functools.lru_cache(maxsize=None)
+def yearly_trend(parameter):
+    return YearlyTrend(parameter)
@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+
+from crime.instrument import count_cache, phase
+from crime.store import get_store
+
+# number of regions kept ready, a region switch after that rebuilds the view from the store
+VIEW_CACHE_SIZE = 128
+
+TABLE_COLUMNS = ['Indent', 'Misdaad', 'Geregistreerde Misdrijven', 'Misdrijven Per 1000 Inw',
+                 'Opgehelderde Misdrijven', 'Opgehelderde Misdrijven Relatief']
+CARD_COLUMNS = ['Geregistreerde Misdrijven', 'Misdrijven Per 1000 Inw']
+BAR_COLUMNS = ['Geregistreerde Misdrijven', 'Opgehelderde Misdrijven']
+
+
+@phase('data')
+def build_region_view(regio):
+    # everything the main page shows for one region, taken from a single slice of the store
+    store = get_store()
+    jaar = store.latest_year
+    top = store.top_categories()
+    data = store.region(regio)
+    latest = data.loc[jaar]
+    first = data.loc[data.index.get_level_values('Perioden').min()]
+
+    table = latest.reset_index().astype({'Misdaad': str})
+    categories = store.hierarchy.reindex(table.Misdaad) # Indent is the depth, it indents the table rows
+    table['Indent'] = categories.depth.fillna(0).astype(int).to_numpy()
+    table = table[TABLE_COLUMNS]
+
+    lines = data['Geregistreerde Misdrijven'].unstack('Misdaad')
+    lines.columns = lines.columns.astype(str)
+    cards = data.loc[jaar - 1:jaar, CARD_COLUMNS].reset_index().astype({'Misdaad': str})
+    return {
+        # the bars show the first year of the region, as when they were taken from its first rows in the csv
+        'bars': first.loc[top[1:], BAR_COLUMNS].reset_index().astype({'Misdaad': str}),
+        'lines': lines, # yearly registered crimes, one column per Misdaad
+        'cards': cards.set_index(['Perioden', 'Misdaad']), # latest and previous year only
+        'population': store.population(regio),
+        'table': table.to_dict('records'),
+        'tooltips': [{'Misdaad': {'value': text, 'type': 'markdown'}} for text in categories.tooltip.fillna('')],
+    }
+
+
+_views = OrderedDict()
+_lock = threading.Lock()
+
+
+def region_view(regio):
+    with _lock:
+        if regio in _views:
+            _views.move_to_end(regio)
+            count_cache('view', True)
+            return _views[regio]
+    count_cache('view', False)
+    store = get_store()
+    view = build_region_view(regio)
+    with _lock:
+        if store is not get_store():
+            return view # the data was refreshed while building, keep only views of the new data
+        _views[regio] = view
+        _views.move_to_end(regio)
+        while len(_views) > VIEW_CACHE_SIZE:
+            _views.popitem(last=False)
+    return view
+
+
+def has_view(regio):
+    # whether region_view(regio) comes from the cache, without building it
+    with _lock:
+        return regio in _views
+
+
+def region_table(regio, depth=None):
+    # (rows, tooltips) of the region table without the categories deeper than depth
+    view = region_view(regio)
+    if depth is None:
+        return view['table'], view['tooltips']
+    keep = [i for i, row in enumerate(view['table']) if row['Indent'] <= depth]
+    return [view['table'][i] for i in keep], [view['tooltips'][i] for i in keep]
+
+
+def clear_views(regions=None):
+    # drop the cached views of the given regions, or all of them
+    with _lock:
+        if regions is None:
+            _views.clear()
+        for regio in regions or []:
+            _views.pop(regio, None)
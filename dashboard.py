@@ -2,11 +2,26 @@ import dash
 from dash import html
 import dash_bootstrap_components as dbc
 from dash import dcc
-
-# use pages = True allows to use multiple pages
-
-app = dash.Dash(__name__, use_pages=True, external_stylesheets=[dbc.themes.SPACELAB])
+from crime.background import background_manager
+from crime.compress import register_compression
+from crime.geo import register_geometry_route
+from crime.ingest import register_refresh
+from crime.instrument import register_instrumentation
+from crime.store import get_store
+from crime.tiles import register_tile_route
+
+# use pages = True allows to use multiple pages. suppress_callback_exceptions because otherwise dash
+# builds the layout of every page on the first request to check the callback ids against; now a page
+# is only built when someone opens it. Callbacks with background=True run in their own process
+
+app = dash.Dash(__name__, use_pages=True, external_stylesheets=[dbc.themes.SPACELAB],
+                suppress_callback_exceptions=True, background_callback_manager=background_manager())
 server = app.server
+register_geometry_route(server) # simplified map shapes, fetched once by the browser and cached
+register_tile_route(server) # vector tiles of the map shapes, used when CRIME_MAP_SOURCE=tiles
+register_refresh(server) # picks up new CBS data written by crime/ingest.py
+register_instrumentation(app) # callback timings on /metrics when CRIME_INSTRUMENT=1
+register_compression(server) # gzip/brotli; registered last, so it runs before the other after_request hooks
 
 
 
@@ -24,11 +39,12 @@ nav = dbc.Nav(
 )
 
 source = html.Div(["bron: ", dcc.Link('CBS Open Data Statline',href = link, target = "_blank")],id = 'source-link')
-date_header = html.Div(["Gebaseerd op data tot 31-12-2022",html.Br()], id = 'date-header')
 
-layout = html.Div(
-    [nav, date_header,source, dash.page_container # dash.page_container contains the page data you find in pages file
-     ])
+def layout(): # a function so the date follows the data after a refresh
+    date_header = html.Div([f"Gebaseerd op data tot 31-12-{get_store().latest_year}",html.Br()], id = 'date-header')
+    return html.Div(
+        [nav, date_header,source, dash.page_container # dash.page_container contains the page data you find in pages file
+         ])
 
 app.layout = layout
 
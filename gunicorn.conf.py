@@ -0,0 +1,31 @@
+# gunicorn settings for the dashboard:
+#   gunicorn -c gunicorn.conf.py dashboard:server
+# The app is imported once in the master (preload_app) and warmed up before the workers are forked,
+# so the data, map shapes and prebuilt figures are shared copy-on-write instead of rebuilt per worker.
+import gc
+import os
+
+bind = os.environ.get('CRIME_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('CRIME_WORKERS', 4))
+threads = int(os.environ.get('CRIME_THREADS', 2))
+preload_app = os.environ.get('CRIME_PRELOAD', '1') == '1'
+
+
+def on_starting(server):
+    # figures on disk from an earlier deploy, once here in the master before any worker uses the directory
+    from crime.background import FIGURE_DIR
+    from crime.cache import FIGURE_CACHE_DIR, FigureCache
+
+    FigureCache(directory=FIGURE_CACHE_DIR or FIGURE_DIR).prune()
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import dashboard
+    from crime.preload import warm_up
+
+    warm_up(dashboard.app)
+    # move everything built so far out of the garbage collector's reach, a collection in a worker
+    # would otherwise write to (and so copy) every shared page that holds a python object
+    gc.freeze()
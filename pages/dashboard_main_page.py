@@ -1,8 +1,8 @@
 
-import geopandas as gpd
 import dash_bootstrap_components as dbc
-import pandas as pd
+import functools
 import json
+import os
 import plotly.express as px
 import plotly.graph_objects as go
 from dash.dash_table import DataTable
@@ -10,46 +10,54 @@ import dash
 from dash import html
 from dash import dcc
 from dash import callback
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 from dash import ctx
+from dash import Patch
+from dash import no_update
+from dash.exceptions import PreventUpdate
+from plotly.colors import make_colorscale
+from crime.background import BACKGROUND_INTERVAL
+from crime.cache import memoize_figure
+from crime.geo import geometry_url, read_gemeenten
+from crime.hover import hover_data, hover_template, hover_value
+from crime.ingest import on_refresh, update_metrics
+from crime.lod import features_geojson, level_for_view, view_from_relayout
+from crime.store import get_store
+from crime.tiles import gemeente_points, tile_layers
+from crime.views import has_view, region_table, region_view, TABLE_COLUMNS
 
 dash.register_page(__name__, path = '/', name = 'Dashboard Misdaad Nederland')
 
-# importing data
+# 'tiles' draws the map polygons from the /tiles endpoint instead of one geojson file with all gemeenten
+MAP_SOURCE = os.environ.get('CRIME_MAP_SOURCE', 'geojson')
 
-NL_misdaad = pd.read_csv('data/Crimefull.csv')
-gdftot = gpd.read_file('data/dataframe.geojson')
-description = pd.read_csv("data/misdrijf_meta.csv")["Description"]
-populatie = pd.read_csv('data/pop.csv')
+# importing data, on the first request that needs it instead of at import
+
+@functools.lru_cache(maxsize=None)
+def gemeente_frame():
+    return read_gemeenten(geometry=False) # the shapes are served separately, see crime/geo.py
+
+@functools.lru_cache(maxsize=None)
+def map_points():
+    # hover points of the tile map, with the values of gemeente_frame
+    return gemeente_points().merge(gemeente_frame(), on='statcode')
+
+# steps of build_region, for its progress bar: line, cards, bars and table
+REGION_STEPS = 4
+
+# levels of the crime categories the table can show, see crime/hierarchy.py
+TABLE_DEPTHS = [('Hoofdgroepen', 1), ('Groepen', 2), ('Subgroepen', 3), ('Alles', 4)]
 
 # Creating functions to create graphs in the dashboard
 
-def create_table(region):
-    used_columns = [
-        "Misdaad",
-        "Geregistreerde Misdrijven",
-        'Misdrijven Per 1000 Inw',
-        'Opgehelderde Misdrijven',
-        'Opgehelderde Misdrijven Relatief'
-    ]
-    df = NL_misdaad.loc[(NL_misdaad.Regio == region) & (NL_misdaad.Perioden == 2022), used_columns]
-    indent = [] # loop to count numeric characters in "Misdaad" column. Helps to create indentation in table
-    for val in df.Misdaad:
-        count = 0
-        for char in val:
-            if char.isnumeric():
-                count += 1
-        indent.append(count)
-    df["Indent"] = indent
-    df = df[['Indent', 'Misdaad', 'Geregistreerde Misdrijven', 'Misdrijven Per 1000 Inw',
-             'Opgehelderde Misdrijven', 'Opgehelderde Misdrijven Relatief']]
+def create_table(region, depth=None):
     # first two columns are text columns, we declare these separately
     columns = [
         {"name": "Indent", "id": "Indent", "type": "text"},
         {"name": "Misdaad", "id": "Misdaad", "type": "text"}]
 
     # for other columns we use loop
-    for name in df.columns[2:]:
+    for name in TABLE_COLUMNS[2:]:
         col_info = {
             "name": name,
             "id": name,
@@ -57,7 +65,7 @@ def create_table(region):
             "format": {'specifier': ','}
         }
         columns.append(col_info)
-    data = df.to_dict("records")
+    data, tooltips = region_table(region, depth)
     crime_table = DataTable(
         id="crime-table",
         columns=columns,
@@ -71,8 +79,7 @@ def create_table(region):
         'Opgehelderde Misdrijven':'Opgehelderde Misdrijven',
         'Opgehelderde Misdrijven Relatief':'Opgehelderde Misdrijven Relatief'
         },
-        tooltip_data=[{ # tooltip for more detailed description of crime
-        'Misdaad': {'value': row, 'type': 'markdown'}} for row in description],
+        tooltip_data=tooltips, # tooltip for more detailed description of crime
         tooltip_delay=0,
         tooltip_duration=None,
         style_table={ #setting table height, need to provide height and minheight
@@ -137,13 +144,14 @@ def create_table(region):
     return crime_table
 
 
+@memoize_figure
 def create_bar(region):
-    data = NL_misdaad[NL_misdaad.Regio.str.contains(region, case=False, regex=False)].drop_duplicates(
-        subset=['CategoryGroupID']).iloc[1:]
-    naam = data.iloc[0, 1]
+    data = region_view(region)['bars'] # main categories only, the total is left out
     fig = go.Figure() #two bars, one for total crimes and one for solved crimes. offsetgroup = 0 to have them overlap
-    fig.add_bar(x=data["Misdaad"], y=data["Geregistreerde Misdrijven"], name="Misdrijven", offsetgroup=0)
-    fig.add_bar(x=data["Misdaad"], y=data["Opgehelderde Misdrijven"], name="Opgelost", offsetgroup=0)
+    fig.add_bar(x=data["Misdaad"], y=data["Geregistreerde Misdrijven"], name="Misdrijven", offsetgroup=0,
+                hovertemplate=hover_value('y', "Geregistreerde Misdrijven"))
+    fig.add_bar(x=data["Misdaad"], y=data["Opgehelderde Misdrijven"], name="Opgelost", offsetgroup=0,
+                hovertemplate=hover_value('y', "Opgehelderde Misdrijven"))
     fig.update_layout(hovermode="x unified", title={"text": f'<b>Selecteer staaf</b>', "x": 0.5, 'font_size':14},
                       margin={"t": 25, "l": 50, "r": 10, "b": 0}
                       , legend={"x": 0.75, "y": 0.95, }
@@ -162,62 +170,80 @@ def create_bar(region):
     return fig
 
 
+@memoize_figure
 def create_line(regio, misdaad):
-    data = NL_misdaad.drop_duplicates(subset=["Perioden", "Regio", "CategoryGroupID"]).sort_values(
-        ["CategoryGroupID", "Perioden"])
+    data = region_view(regio)['lines'][misdaad].rename("Geregistreerde Misdrijven").reset_index()
     misdaad_title = misdaad[2:]
     if misdaad == 'Misdrijven, totaal':
         misdaad_title = misdaad
-    data = data[(data.Regio.str.contains(regio, case=False, regex=False)) & (data.Misdaad == misdaad)]
-    fig = px.line(data_frame=data, x="Perioden", y="Geregistreerde Misdrijven", color=data["Misdaad"])
+    fig = px.line(data_frame=data, x="Perioden", y="Geregistreerde Misdrijven", color=[misdaad] * len(data))
     fig.update_layout(hovermode="x unified", title={"text": f'{misdaad_title} in {regio}', "x": 0.5}, showlegend=False,
                       margin={"t": 40, "l": 50, "r": 10, "b": 0}, xaxis_title=None, yaxis_title=None)
-    fig.update_traces(hovertemplate=' %{y}')
+    fig.update_traces(hovertemplate=' ' + hover_value('y', "Geregistreerde Misdrijven"))
     return fig
 
-# Function to create custom text. Will be used to create hover data for map figure
-def hover_text(x):
-
-    name = x["statnaam"]
-    crimes = x["Geregistreerde Misdrijven"]
-    crimest = x["Misdrijven Per 1000 Inw"]
-    solvedr = x['Opgehelderde Misdrijven Relatief']
-    return (
-        f"<b>{name}</b><br>"
-        f"Geregistreerde Misdrijven - {crimes:,.0f}<br>"
-        f"Misdrijven Per 1000 Inw - {crimest}<br>"
-        f"Opgehelderde Misdrijven Relatief - {solvedr}%<br>"
-    )
+# values shown when hovering over a gemeente on the map
+MAP_HOVER_COLUMNS = ["Geregistreerde Misdrijven", "Misdrijven Per 1000 Inw", 'Opgehelderde Misdrijven Relatief']
 
-def create_map(param, reverse=False):
-    color = 'ylorrd' # color scale from yellow to red, low is better high is worse
+# map tab value -> (column shown on the map, reverse color scale)
+MAP_METRICS = {
+    'Geregistreerde Misdrijven': ('Geregistreerde Misdrijven', False),
+    'Misdrijven per 1000 Inw': ('Misdrijven Per 1000 Inw', False),
+    'Opgehelderde Misdrijven Relatief': ('Opgehelderde Misdrijven Relatief', True),
+}
+
+def map_colorscale(reverse=False):
+    # explicit scale instead of a name, so a callback can send it to the browser as is
     if reverse:
-        color = 'rdylgn' #reverse color scale when user indicates reverse = True
-    text = gdftot.apply(hover_text, axis=1) #create hover text with custom function
+        return make_colorscale(px.colors.diverging.RdYlGn) #reverse color scale, high is better
+    return make_colorscale(px.colors.sequential.YlOrRd) # color scale from yellow to red, low is better high is worse
+
+@memoize_figure
+def create_map(param, reverse=False):
+    gdftot = gemeente_frame()
     fig = px.choropleth_mapbox(gdftot,
-                               geojson=gdftot.geometry,
-                               locations=gdftot.index,
+                               geojson=geometry_url(),
+                               locations=gdftot.statcode,
                                color=gdftot[param],
                                mapbox_style="carto-positron",
                                title="Misdaad",
                                center={"lat": 52.132633, "lon": 5.291266},
                                zoom=5.9,
-                               color_continuous_scale=color)
+                               color_continuous_scale=map_colorscale(reverse))
     fig.update_layout(margin={"t": 0, "l": 10, "r": 10, "b": 0},
                       coloraxis_colorbar=dict(title=""))
-    fig.update_traces(hovertemplate=text),
+    fig.update_traces(customdata=hover_data(gdftot, MAP_HOVER_COLUMNS, title="statnaam"),
+                      hovertemplate=hover_template(MAP_HOVER_COLUMNS))
     return fig
 
+@memoize_figure
+def create_tile_map(param, reverse=False):
+    # polygons come as vector tiles, one fill layer per color class. A point on every gemeente carries
+    # the hover text and the colorbar
+    colorscale = map_colorscale(reverse)
+    points = map_points()
+    fig = go.Figure(go.Scattermapbox(lon=points.lon, lat=points.lat, mode='markers', name='',
+                                     marker=dict(size=10, opacity=0, color=points[param], colorscale=colorscale,
+                                                 showscale=True, colorbar=dict(title="")),
+                                     customdata=hover_data(points, MAP_HOVER_COLUMNS, title="statnaam"),
+                                     hovertemplate=hover_template(MAP_HOVER_COLUMNS)))
+    fig.update_layout(mapbox=dict(style="carto-positron", center={"lat": 52.132633, "lon": 5.291266}, zoom=5.9,
+                                  layers=tile_layers(param, colorscale)),
+                      margin={"t": 0, "l": 10, "r": 10, "b": 0})
+    return fig
 
 # preparing data for dropdown menu containing all regions
-steden = NL_misdaad.loc[(NL_misdaad.Perioden == 2022)].dropna(thresh=7, axis=0)
-stedendict = dict(zip(steden.Regio, steden.Regio))
-stedenlabels = [{'label': k, 'value': v} for k, v in stedendict.items()]
+def region_options():
+    store = get_store()
+    # the csv this was written for has 7 columns that are never empty (ID ... Soortmisdrijf), so its
+    # dropna(thresh=7) kept every region with rows in the latest year, whatever numbers are missing
+    steden = store.frame.loc[(store.frame.Perioden == store.latest_year)].dropna(subset=['Regio'])
+    stedendict = dict(zip(steden.Regio.astype(str), steden.Regio.astype(str)))
+    return [{'label': k, 'value': v} for k, v in stedendict.items()]
 
 
-def create_tab(content, label, value):
+def create_tab(label, value):
     return dcc.Tab(
-        content,
         label=label,
         value=value,
         id=f"{value}-tab",
@@ -228,11 +254,10 @@ def create_tab(content, label, value):
 # functions to create cards 
 
 def create_card_crime(regio, misdaad):
-    mask1 = NL_misdaad.Perioden == 2022
-    mask2 = NL_misdaad.Regio == regio
-    mask3 = NL_misdaad.Misdaad == misdaad
-    param22 = NL_misdaad.loc[mask1&mask2&mask3,'Geregistreerde Misdrijven'].item()
-    param21 = NL_misdaad.loc[(NL_misdaad.Perioden == 2021)&mask2&mask3,'Geregistreerde Misdrijven'].item()
+    jaar = get_store().latest_year
+    cards = region_view(regio)['cards']
+    param22 = cards.at[(jaar, misdaad), 'Geregistreerde Misdrijven']
+    param21 = cards.at[(jaar - 1, misdaad), 'Geregistreerde Misdrijven']
     try:
         change = round((-1 + param22/param21)*100,2)
     except ZeroDivisionError:
@@ -244,18 +269,17 @@ def create_card_crime(regio, misdaad):
     if change < 0: #if change is lower than 0 dont use + symbol
         symbol = ""
     card = dbc.Card([
-                dbc.CardHeader([html.H6('Geregistreerde Misdrijven'),html.P("vs 2021",style = {'font-size':'12px', 'marginBottom':'2px'})],
+                dbc.CardHeader([html.H6('Geregistreerde Misdrijven'),html.P(f"vs {jaar - 1}",style = {'font-size':'12px', 'marginBottom':'2px'})],
                               style = {'background-color': '#2F4F4F','color':'white','border-radius': '15px 15px 0px 0px'}),
                 dbc.CardBody([html.H6(f"{param22:,.0f}"),html.P(f'{symbol}{change}%',style =  {'color':color, 'font-size':'12px'})])
     ],color="primary",className="mb-4",outline=True,style = {'text-align':"center",'border-radius': '15px 15px 20px 20px'})
     return card
 
 def create_card_crime_t(Regio, misdaad):
-    mask1 = NL_misdaad.Perioden == 2022
-    mask2 = NL_misdaad.Regio == Regio
-    mask3 = NL_misdaad.Misdaad == misdaad
-    param22 = NL_misdaad.loc[mask1&mask2&mask3,"Misdrijven Per 1000 Inw"].item()
-    param21 = NL_misdaad.loc[(NL_misdaad.Perioden == 2021)&mask2&mask3,"Misdrijven Per 1000 Inw"].item()
+    jaar = get_store().latest_year
+    cards = region_view(Regio)['cards']
+    param22 = cards.at[(jaar, misdaad), "Misdrijven Per 1000 Inw"]
+    param21 = cards.at[(jaar - 1, misdaad), "Misdrijven Per 1000 Inw"]
     change = round(param22-param21,1)
     color = 'red'
     symbol = "+"
@@ -264,22 +288,22 @@ def create_card_crime_t(Regio, misdaad):
     if change < 0: #if change is lower than dont use + symbol
         symbol = ""
     card = dbc.Card([
-                dbc.CardHeader([html.H6("Misdrijven Per 1000 Inw"),html.P("vs 2021",style = {'font-size':'12px', 'marginBottom':'2px'})],
+                dbc.CardHeader([html.H6("Misdrijven Per 1000 Inw"),html.P(f"vs {jaar - 1}",style = {'font-size':'12px', 'marginBottom':'2px'})],
                               style = {'background-color': '#2F4F4F','color':'white','border-radius': '15px 15px 0px 0px'}),
                 dbc.CardBody([html.H6(f"{param22}"),html.P(f'{symbol}{change}',style =  {'color':color, 'font-size':'12px'})])
     ],color="primary",className="mb-4",outline=True)
     return card
 
 def create_card_pop(Regio):
-    try:
-        mask1 = populatie.Regio == Regio
-        pop = populatie.loc[mask1,"Populatie"].item()
+    store = get_store()
+    pop = region_view(Regio)['population']
+    if pop is not None:
         card = dbc.Card([
-                dbc.CardHeader([html.H6("Populatie"),html.P("1 Januari 2022",style = {'font-size':'12px', 'marginBottom':'2px'})],
+                dbc.CardHeader([html.H6("Populatie"),html.P(f"1 Januari {store.latest_year}",style = {'font-size':'12px', 'marginBottom':'2px'})],
                               style = {'background-color': '#2F4F4F','color':'white','border-radius': '15px 15px 0px 0px'}),
                 dbc.CardBody([html.H6(f"{pop:,.0f}")])
         ],color="primary",className="mb-4",outline=True)
-    except ValueError: #there's a few regions with no definable population, in that case display NA for population
+    else: #there's a few regions with no definable population, in that case display NA for population
         card = dbc.Card([
                 dbc.CardHeader([html.H6("Populatie")],
                               style = {'background-color': '#2F4F4F','color':'white','border-radius': '15px 15px 0px 0px'}),
@@ -288,14 +312,10 @@ def create_card_pop(Regio):
 
 #creating the graphs and tabs using previously defined functions
 
-misdrijven_relatief = dcc.Graph(figure=create_map("Misdrijven Per 1000 Inw"))
-misdrijven_totaal = dcc.Graph(figure=create_map("Geregistreerde Misdrijven"))
-Opgehelderde_Misdrijven = dcc.Graph(figure=create_map("Opgehelderde Misdrijven Relatief", reverse=True))
-
-tab_misdrijven_relatief = create_tab(misdrijven_relatief, 'Misdrijven per 1000 Inw', 'Misdrijven per 1000 Inw')
-tab_misdrijven_totaal = create_tab(misdrijven_totaal, "Geregistreerde Misdrijven", "Geregistreerde Misdrijven")
-tab_misdrijven_opgehelderd = create_tab(Opgehelderde_Misdrijven, "Opgehelderde Misdrijven Relatief",
-                                        "Opgehelderde Misdrijven Relatief")
+# the tabs only pick the metric, they all share the single map below
+tab_misdrijven_relatief = create_tab('Misdrijven per 1000 Inw', 'Misdrijven per 1000 Inw')
+tab_misdrijven_totaal = create_tab("Geregistreerde Misdrijven", "Geregistreerde Misdrijven")
+tab_misdrijven_opgehelderd = create_tab("Opgehelderde Misdrijven Relatief", "Opgehelderde Misdrijven Relatief")
 
 map_tabs = dcc.Tabs(
     [tab_misdrijven_totaal, tab_misdrijven_relatief, tab_misdrijven_opgehelderd],
@@ -303,106 +323,157 @@ map_tabs = dcc.Tabs(
     id="table-tabs",
     value='Misdrijven per 1000 Inw')
 
-card_div = html.Div([create_card_pop('Nederland'), create_card_crime("Nederland", "Misdrijven, totaal"),
-                     create_card_crime_t("Nederland","Misdrijven, totaal")],
-                    style = {'gridArea':'cards','margin-top':'50px'}, id = 'cards-div')
-
-fig_map = create_map("Misdrijven Per 1000 Inw")
-map_graph = dcc.Graph(figure=fig_map, id="map-graph")
-map_div = html.Div([map_tabs], style={'gridArea': 'maps', 'margin-top': '10px'})
-
-regio = "Nederland"
-misdaad = "Misdrijven, totaal"
-
-dropdown = dcc.Dropdown(id='city-picker', options=stedenlabels,
-                        value='Nederland', clearable = False)
-
-# dropdowndiv = html.Div([html.H6('Regio:', id = 'dropdowntitle'), dropdown], id = 'dropdown-div')
-# dropdowndiv.style = {'gridArea': "dropdown"}
-table = create_table(regio)
-tablediv = html.Div([ table])
-tablediv.style = {'gridArea': "tables"}
-line = dcc.Graph(figure=create_line(regio, misdaad), id='line',
-                 style={'height': "calc(25vh - 30px)", "margin-bottom": "30px"})
-lineheader = html.H1("Jaarlijkse Ontwikkeling", className='graph-header')
-linediv = html.Div([lineheader, line],style ={'gridArea': 'line'} )
-
-bars = dcc.Graph(figure=create_bar(regio), id='bars', style={'height': "calc(35vh - 30px)"})
-barheader = html.H1("Verdeling Misdaad per Categorie (Totaal vs Opgelost)", className='graph-header')
-#
-bardiv = html.Div([barheader, bars])
-bardiv.style = {'gridArea': "bar", 'margin-bottom': '0px'}
-
-container = html.Div([card_div, dropdown, tablediv, bardiv, linediv, map_div], id = 'container')
-
-layout = html.Div([container], style = {'max-width': '2000px','margin': 'auto'})
+# the page is built once per version of the data, a refresh (see crime/ingest.py) builds it again
+@functools.lru_cache(maxsize=1)
+def build_layout(version):
+    card_div = html.Div([create_card_pop('Nederland'), create_card_crime("Nederland", "Misdrijven, totaal"),
+                         create_card_crime_t("Nederland","Misdrijven, totaal")],
+                        style = {'gridArea':'cards','margin-top':'50px'}, id = 'cards-div')
+
+    if MAP_SOURCE == 'tiles':
+        map_graph = dcc.Graph(figure=create_tile_map(*MAP_METRICS[map_tabs.value]), id="map-graph")
+    else:
+        map_graph = dcc.Graph(figure=create_map(*MAP_METRICS[map_tabs.value]), id="map-graph")
+    map_level = dcc.Store(id='map-level') # name of the finer map level shown, empty for gemeenten
+    map_div = html.Div([map_tabs, map_graph, map_level], style={'gridArea': 'maps', 'margin-top': '10px'})
+
+    regio = "Nederland"
+    misdaad = "Misdrijven, totaal"
+
+    dropdown = dcc.Dropdown(id='city-picker', options=region_options(),
+                            value='Nederland', clearable = False)
+
+    # dropdowndiv = html.Div([html.H6('Regio:', id = 'dropdowntitle'), dropdown], id = 'dropdown-div')
+    # dropdowndiv.style = {'gridArea': "dropdown"}
+    table = create_table(regio)
+    table_depth = dcc.RadioItems(id='table-depth', options=[{'label': label, 'value': depth} for label, depth in TABLE_DEPTHS],
+                                 value=TABLE_DEPTHS[-1][1], inline=True, inputStyle={'margin': '0px 4px 0px 10px'})
+    tablediv = html.Div([table_depth, table])
+    tablediv.style = {'gridArea': "tables"}
+    line = dcc.Graph(figure=create_line(regio, misdaad), id='line',
+                     style={'height': "calc(25vh - 30px)", "margin-bottom": "30px"})
+    lineheader = html.H1("Jaarlijkse Ontwikkeling", className='graph-header')
+    # shown while build_region runs in the background, region-job is the region it builds
+    progress = html.Progress(id='region-progress', value=0, max=REGION_STEPS,
+                             style={'visibility': 'hidden', 'width': '100%', 'height': '4px'})
+    region_job = [dcc.Store(id='region-job'), dcc.Store(id='region-running', data=False)]
+    linediv = html.Div([lineheader, progress, line] + region_job, style ={'gridArea': 'line'} )
+
+    bars = dcc.Graph(figure=create_bar(regio), id='bars', style={'height': "calc(35vh - 30px)"})
+    barheader = html.H1("Verdeling Misdaad per Categorie (Totaal vs Opgelost)", className='graph-header')
+    #
+    bardiv = html.Div([barheader, bars])
+    bardiv.style = {'gridArea': "bar", 'margin-bottom': '0px'}
+
+    container = html.Div([card_div, dropdown, tablediv, bardiv, linediv, map_div], id = 'container')
+
+    return html.Div([container], style = {'max-width': '2000px','margin': 'auto'})
+
+def layout():
+    return build_layout(get_store().version)
+
+@on_refresh
+def refresh_figures(refresh):
+    # new data for some regions: their figures and, for gemeenten, the map values
+    for regio in refresh.regions:
+        create_bar.invalidate(regio)
+        create_line.invalidate(regio)
+    metrics = refresh.gemeente_metrics()
+    if len(metrics):
+        update_metrics(gemeente_frame(), metrics)
+        map_points.cache_clear() # merged again from the updated frame when the tile map needs it
+        create_map.invalidate()
+        create_tile_map.invalidate()
 
 #callbacks to update figures interactively
 
-
-
-@callback(Output('line', 'figure'), 
-              [Input('bars', 'clickData')], Input('city-picker', 'value'))
-def changeline(clickData, regio):
-    crime = 'Misdrijven, totaal'
-    button_clicked = ctx.triggered_id
-    if button_clicked == 'bars':
-        crime = json.dumps(clickData['points'][0]['label']).replace('"', '')
-    return create_line(regio, crime)
-
-
-@callback(Output('bars', 'figure'),
-              [Input('city-picker', 'value')])
-def changebars(regio):
-    return create_bar(regio)
-
-@callback(Output('cards-div','children'),
-             [Input('city-picker','value'),
-              Input('bars', 'clickData')])
-
-def changecards(regio, clickData):
+@callback(Output('map-graph', 'figure'), Output('map-level', 'data'),
+          Input('table-tabs', 'value'), Input('map-graph', 'relayoutData'),
+          State('map-level', 'data'), prevent_initial_call=True)
+def changemap(tab, relayout, shown_level):
+    # Tabs only change the colors. Zooming in past a finer level (see crime/lod.py) swaps the gemeente
+    # shapes for the polygons inside the view, zooming back out restores them
+    trigger = ctx.triggered_id
+    if MAP_SOURCE == 'tiles':
+        if trigger == 'map-graph':
+            return no_update, no_update # the browser fetches the tiles for the view itself
+        param, reverse = MAP_METRICS[tab]
+        fig = Patch()
+        fig['layout']['mapbox']['layers'] = tile_layers(param, map_colorscale(reverse))
+        fig['data'][0]['marker']['color'] = map_points()[param].tolist()
+        fig['data'][0]['marker']['colorscale'] = map_colorscale(reverse)
+        return fig, no_update
+    view = view_from_relayout(relayout)
+    if trigger == 'map-graph' and view is None:
+        return no_update, no_update # resize or other event that doesn't move the map
+    level, frame = level_for_view(*view) if view else (None, None)
+    level_name = level.name if level else None
+    if trigger == 'map-graph' and level_name is None and shown_level is None:
+        return no_update, no_update # moving around at gemeente level, the browser has all shapes
+
+    param, reverse = MAP_METRICS[tab]
+    if level is None:
+        frame = gemeente_frame()
+    fig = Patch()
+    if trigger == 'map-graph' or level_name != shown_level:
+        fig['data'][0]['geojson'] = geometry_url() if level is None else features_geojson(frame)
+        fig['data'][0]['locations'] = frame.statcode.tolist()
+        fig['data'][0]['customdata'] = hover_data(frame, MAP_HOVER_COLUMNS, title="statnaam").tolist()
+    fig['data'][0]['z'] = frame[param].tolist()
+    fig['layout']['coloraxis']['colorscale'] = map_colorscale(reverse)
+    return fig, level_name
+
+def region_outputs(regio, crime, depth, step=lambda n: None):
+    # line, bars, cards, table rows and tooltips of a region, all from the same cached slice of the store,
+    # region_view(regio). step(n) after each of the REGION_STEPS
+    line = create_line(regio, crime)
+    step(1)
+    cards = create_card_pop(regio), create_card_crime(regio, crime), create_card_crime_t(regio, crime)
+    step(2)
+    bars = create_bar(regio)
+    step(3)
+    table = region_table(regio, depth)
+    step(REGION_STEPS)
+    return (line, bars, cards) + table
+
+# one request per interaction: the region, the clicked bar and the table level all go to this callback,
+# which only sends the outputs the change affects. Only a region whose view this worker doesn't have yet
+# goes to build_region, a background job (see crime/background.py): the callback just names it in
+# region-job. While that job runs any other change replaces it, a new region by starting a job for that
+# one (dash cancels the old job), everything else by updating all outputs here and emptying region-job
+@callback(Output('line', 'figure'), Output('bars', 'figure'), Output('cards-div', 'children'),
+          Output('crime-table', 'data'), Output('crime-table', 'tooltip_data'), Output('region-job', 'data'),
+          Input('city-picker', 'value'), Input('bars', 'clickData'), Input('table-depth', 'value'),
+          State('region-running', 'data'),
+          prevent_initial_call=True) # the layout already shows Nederland
+def update_region(regio, clickData, depth, running):
+    trigger = ctx.triggered_id
+    if trigger == 'city-picker' and not has_view(regio):
+        return (no_update,) * 5 + (regio,)
     crime = 'Misdrijven, totaal'
-    button_clicked = ctx.triggered_id
-    if button_clicked == 'bars':
+    if trigger == 'bars':
         crime = json.dumps(clickData['points'][0]['label']).replace('"', '')
-    return create_card_pop(regio),create_card_crime(regio, crime),create_card_crime_t(regio, crime)
-
-@callback(Output('crime-table', 'data'),
-              [Input('city-picker', 'value')])
-def changetable(regio): #output to change table is data, we recreate data to fill the table
-    used_columns = [
-        "Misdaad",
-        "Geregistreerde Misdrijven",
-        'Misdrijven Per 1000 Inw',
-        'Opgehelderde Misdrijven',
-        'Opgehelderde Misdrijven Relatief'
-    ]
-    df = NL_misdaad.loc[(NL_misdaad.Regio == regio) & (NL_misdaad.Perioden == 2022), used_columns]
-    indent = []
-    for val in df.Misdaad:
-        count = 0
-        for char in val:
-            if char.isnumeric():
-                count += 1
-        indent.append(count)
-    df["Indent"] = indent
-    df = df[['Indent', 'Misdaad', 'Geregistreerde Misdrijven', 'Misdrijven Per 1000 Inw',
-             'Opgehelderde Misdrijven', 'Opgehelderde Misdrijven Relatief']]
-    # first two columns are text columns, we declare these separately
-    # columns = [
-    #     {"name": "Indent", "id": "Indent", "type": "text"},
-    #     {"name": "Misdaad", "id": "Misdaad", "type": "text"}]
-
-    # for other columns we use loop
-    # for name in df.columns[2:]:
-    #     col_info = {
-    #         "name": name,
-    #         "id": name,
-    #         "type": "numeric",
-    #         "format": {'specifier': ','}
-    #     }
-    #     columns.append(col_info)
-    data = df.to_dict("records")
-    return data
-
-
+    if running: # the job builds a region that is no longer shown, or the outputs of another table level
+        return region_outputs(regio, crime, depth) + (None,)
+    if trigger == 'table-depth': #the rows are cached per region, a level only leaves the deeper ones out
+        return (no_update, no_update, no_update) + region_table(regio, depth) + (no_update,)
+    if trigger == 'bars': # same region, the bars and the table stay
+        line = create_line(regio, crime)
+        cards = create_card_pop(regio), create_card_crime(regio, crime), create_card_crime_t(regio, crime)
+        return line, no_update, cards, no_update, no_update, no_update
+    return region_outputs(regio, crime, depth) + (no_update,)
+
+@callback(Output('line', 'figure', allow_duplicate=True), Output('bars', 'figure', allow_duplicate=True),
+          Output('cards-div', 'children', allow_duplicate=True), Output('crime-table', 'data', allow_duplicate=True),
+          Output('crime-table', 'tooltip_data', allow_duplicate=True),
+          Input('region-job', 'data'), State('table-depth', 'value'),
+          background=True, interval=BACKGROUND_INTERVAL,
+          progress=[Output('region-progress', 'value')],
+          running=[(Output('region-progress', 'style'), {'visibility': 'visible', 'width': '100%', 'height': '4px'},
+                    {'visibility': 'hidden', 'width': '100%', 'height': '4px'}),
+                   (Output('region-running', 'data'), True, False)],
+          prevent_initial_call=True)
+def build_region(set_progress, regio, depth):
+    if regio is None: # emptied by update_region, this only cancels the job that was running
+        raise PreventUpdate
+    return region_outputs(regio, 'Misdrijven, totaal', depth, set_progress)
@@ -1,46 +1,54 @@
-import pandas as pd
+import functools
 import plotly.express as px
 import dash_bootstrap_components as dbc
 import dash
 from dash import html
 from dash import dcc
 from dash import callback
-from dash.dependencies import Input, Output
+from dash import clientside_callback
+from dash import Patch
+from dash import no_update
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from dash.dash_table import DataTable
+from crime.cache import memoize_figure
+from crime.ingest import on_refresh
+from crime.scatter import SCATTER_MAX_POINTS, axis_view, scatter_figure, scatter_trace
+from crime.store import get_store
+from crime.tablequery import query_page
+from crime.trends import yearly_trend
 
 dash.register_page(__name__, path='/inzichten', name='Inzichten Misdaad Nederland') # register the page so it can be used by the main app
 
 
 
-NL_misdaad = pd.read_csv('data/Crimefull.csv') #importing data
+#read in text for dataframe, the blocks between the tables and graphs are separated by '$'
+@functools.lru_cache(maxsize=None)
+def page_text():
+    with open('data/text.txt') as f:
+        return f.read().split('$')
 
-#read in text for dataframe
-f =  open('data/text.txt')
-datatext = f.read()
+# population against crime, one point per gemeente. Many points are drawn with WebGL and binned, see crime/scatter.py
+SCATTER_LABELS = {'BevolkingOp1Januari_1': "Populatie"}
 
-def create_scatter():
-    df = NL_misdaad.loc[NL_misdaad.RegioS.str.contains("GM")]
-    df = df.loc[(df.Misdaad == "Misdrijven, totaal")]
-    df = df.loc[df.Perioden == 2022]
-    fig = px.scatter(df, x='BevolkingOp1Januari_1', y='Misdrijven Per 1000 Inw',
-                         hover_name="Regio",labels = {'BevolkingOp1Januari_1':"Populatie"})
-    return fig
+@functools.lru_cache(maxsize=None)
+def scatter_df():
+    store = get_store()
+    df = store.indexed.xs((store.latest_year, "Misdrijven, totaal"), level=['Perioden', 'Misdaad']).reset_index()
+    return df.loc[df.RegioS.str.contains("GM")]
 
-def crimes_per_year(parameter):
-    mask = NL_misdaad.Regio == "Nederland"
-    df = NL_misdaad.loc[mask].copy()
-    df = df.drop_duplicates(subset=["CategoryGroupID", "Perioden"]).sort_values(
-        ['Perioden', "CategoryGroupID"]).set_index(["Perioden", "Misdaad"]).copy()
-    df = df.loc[:, parameter].unstack(1).copy()
-    return df
+def scatter_points(view):
+    return scatter_trace(scatter_df(), 'BevolkingOp1Januari_1', 'Misdrijven Per 1000 Inw', 'Regio',
+                         SCATTER_LABELS, view, unit='gemeenten')
+
+@memoize_figure
+def create_scatter():
+    return scatter_figure(scatter_df(), 'BevolkingOp1Januari_1', 'Misdrijven Per 1000 Inw', 'Regio',
+                          SCATTER_LABELS, unit='gemeenten')
 
+@memoize_figure
 def bars_crime_change(year1,year2,parameter):
-    df = crimes_per_year(parameter)
-    df = round(df.loc[year2] / df.loc[year1] * 100, 1)
-    if parameter == "Opgehelderde Misdrijven Relatief":
-        df = crimes_per_year(parameter)
-        df = round(df.loc[year2] - df.loc[year1],2)
-    fig = px.bar(df, orientation='h', text = [f'{i}%' for i in df])
+    df = yearly_trend(parameter).between(year1, year2)
+    fig = px.bar(df, orientation='h', text = [f'{i:.1f}%' for i in df])
     fig.update_layout(showlegend=False, margin_r = 0)
     fig.update_xaxes(visible=False)
     fig.update_traces(hovertemplate='%{y} : %{x}%<extra></extra>')
@@ -48,11 +56,9 @@ def bars_crime_change(year1,year2,parameter):
 
 
 
+@memoize_figure
 def line_yearly_crime(year1,year2,parameter):
-    df = crimes_per_year(parameter)
-    df = df.loc[year1:year2]
-    if parameter == 'Geregistreerde Misdrijven':
-        df = round(df.div(df.loc[year1])*100,1)
+    df = yearly_trend(parameter).development(year1, year2)
     fig = px.line(df)
     fig.update_layout(hovermode = 'x unified')
     fig.update_traces(hovertemplate=' %{y}%')
@@ -63,26 +69,23 @@ def line_yearly_crime(year1,year2,parameter):
     fig['data'][7]['name'] = '8 Misdrijven overige<br> wetten'
     return fig
 
-# create df for DataTable
+GEMEENTE_PAGE_SIZE = 50
+
+# create df for DataTable, once. The table pages, sorts and filters it on the server
+@functools.lru_cache(maxsize=None)
 def datatable_crime_df():
-    maskcrime = NL_misdaad.Misdaad == "Misdrijven, totaal"
-    maskregion = NL_misdaad.RegioS.str.contains('GM')
-    df = NL_misdaad[maskcrime & maskregion].set_index(['Perioden', 'Regio'])['Misdrijven Per 1000 Inw'].unstack(0).copy()
-    df = df[df[2022].notna()]
-    df['Verschil'] = round(df[2022] - df.fillna(method='bfill', axis=1).iloc[:, 0], 2)
-    df.sort_values('Verschil', ascending=True)
+    store = get_store()
+    df = store.indexed.xs("Misdrijven, totaal", level='Misdaad')
+    df = df.loc[df.RegioS.str.contains('GM'), 'Misdrijven Per 1000 Inw'].unstack(1)
+    df.index = df.index.astype(str)
+    df = df[df[store.latest_year].notna()]
+    df['Verschil'] = round(df[store.latest_year] - df.fillna(method='bfill', axis=1).iloc[:, 0], 2)
     df = df.reset_index()
-    df.columns = ['Regio', '2010', '2011', '2012', '2013', '2014',
-                      '2015', '2016', '2017', '2018', '2019', '2020',
-                      '2021', '2022', 'Verschil']
+    df.columns = df.columns.astype(str) # 'Regio', '2010' ... latest year, 'Verschil'
     return df
 
 def create_crime_table():
     df = datatable_crime_df()
-    used_columns = ['Regio', '2010', '2011', '2012', '2013', '2014',
-                    '2015', '2016', '2017', '2018', '2019', '2020',
-                    '2021', '2022', 'Verschil']
-
     #Regio column is text type, the other ones are numeric
 
     columns = [
@@ -97,9 +100,9 @@ def create_crime_table():
             "format": {'specifier': ','}
         }
         columns.append(col_info)
-    data = df.sort_values('Regio').to_dict("records")
+    data, page_count = query_page(df, 0, GEMEENTE_PAGE_SIZE, [{'column_id': 'Regio', 'direction': 'asc'}])
     crime_table = DataTable(
-        id="crime-table",
+        id="gemeente-table",
         columns=columns,
         data=data,
         fixed_rows={"headers": True},
@@ -134,11 +137,15 @@ def create_crime_table():
                 "textAlign": "left",
             },
         ],
-        sort_action='native',
-        filter_action='native',
+        sort_action='custom',
+        sort_by=[{'column_id': 'Regio', 'direction': 'asc'}],
+        filter_action='custom',
+        filter_query='',
         filter_options={'case': 'insensitive'},
-        page_size=150,
-        virtualization=True,
+        page_action='custom',
+        page_current=0,
+        page_size=GEMEENTE_PAGE_SIZE,
+        page_count=page_count,
         style_data_conditional=[  # conditional styling for the data within the cells
             {
                 "if": {"row_index": "odd"},
@@ -149,67 +156,97 @@ def create_crime_table():
     return crime_table
 
 
-scatter_graph = dcc.Graph(figure=create_scatter(), id="scatter-graph", style={"width": "90vw", 'max-width': '1500px', 'margin-left': 'auto',
-	                        'margin-right': 'auto' })
-
-bars_dev_crime = dcc.Graph(figure=bars_crime_change(2010,2022,'Geregistreerde Misdrijven'), id="bars-change-graph", style={"width": "50vw", 'max-width': '900px'})
-line_dev_crime = dcc.Graph(figure=line_yearly_crime(2010,2022,'Geregistreerde Misdrijven'), id="line-graph", style={"width": "50vw", 'max-width': '900px'})
-slider_crime = html.Div([dcc.RangeSlider(2010, 2022, 2, marks={i: '{}'.format(i) for i in range(2010, 2023)},
-                                   value=[2010, 2022], id='range-slider-crime')],
-                  style={"width": '70%', 'padding-left': '25%', 'margin-bottom': '50px'})
-
-bars_dev_solved_crime = dcc.Graph(figure=bars_crime_change(2010,2022,'Opgehelderde Misdrijven Relatief'), id="bars-solved-crime", style={"width": "50vw", 'max-width': '900px'})
-line_dev_solved_crime = dcc.Graph(figure=line_yearly_crime(2010,2022,'Opgehelderde Misdrijven Relatief'), id="line-solved-crime", style={"width": "50vw", 'max-width': '900px'})
-slider_solved_crime = html.Div([dcc.RangeSlider(2010, 2022, 2, marks={i: '{}'.format(i) for i in range(2010, 2023)},
-                                   value=[2010, 2021], id='range-slider-solved-crime')],
-                  style={"width": '70%', 'padding-left': '25%', 'margin-bottom': '50px'})
-
-layout = html.Div([dcc.Markdown('# Ontwikkeling misdaad per gemeente', style={'text-align': 'center'}),
-                   dcc.Markdown(datatext.split('$')[0], className='textbox'),
-                   html.Div([dbc.Row([create_crime_table()])],id = 'table_div'),
-                   dcc.Markdown(datatext.split('$')[1], className='textbox'),
-                   html.Div([scatter_graph]),
-                   html.Hr(),
-                   dcc.Markdown('# Ontwikkeling misdaad per categorie', style={'text-align': 'center'}),
-                   dcc.Markdown(datatext.split('$')[2], className='textbox'),
-                   #dropdown,
-                   dbc.Row([bars_dev_crime, line_dev_crime]),
-                   slider_crime,
-                   dcc.Markdown(datatext.split('$')[3], className='textbox'),
-                   dbc.Row([bars_dev_solved_crime, line_dev_solved_crime]),
-                   slider_solved_crime
-                   ],
-                  style={'max-width': '2000px', 'margin': 'auto'})
-
-
-#callbacks to update graphs
+# the page is built once per version of the data, a refresh (see crime/ingest.py) builds it again
+@functools.lru_cache(maxsize=1)
+def build_layout(version):
+    last = get_store().latest_year
+    scatter_graph = dcc.Graph(figure=create_scatter(), id="scatter-graph", style={"width": "90vw", 'max-width': '1500px', 'margin-left': 'auto',
+    	                        'margin-right': 'auto' })
+    scatter_view = dcc.Store(id='scatter-view') # zooms of a binned scatter, see zoom_scatter
+
+    bars_dev_crime = dcc.Graph(figure=bars_crime_change(2010,last,'Geregistreerde Misdrijven'), id="bars-change-graph", style={"width": "50vw", 'max-width': '900px'})
+    line_dev_crime = dcc.Graph(figure=line_yearly_crime(2010,last,'Geregistreerde Misdrijven'), id="line-graph", style={"width": "50vw", 'max-width': '900px'})
+    slider_crime = html.Div([dcc.RangeSlider(2010, last, 2, marks={i: '{}'.format(i) for i in range(2010, last + 1)},
+                                       value=[2010, last], id='range-slider-crime'),
+                             dcc.Store(id='trend-crime', data=yearly_trend('Geregistreerde Misdrijven').to_store())],
+                      style={"width": '70%', 'padding-left': '25%', 'margin-bottom': '50px'})
+
+    bars_dev_solved_crime = dcc.Graph(figure=bars_crime_change(2010,last,'Opgehelderde Misdrijven Relatief'), id="bars-solved-crime", style={"width": "50vw", 'max-width': '900px'})
+    line_dev_solved_crime = dcc.Graph(figure=line_yearly_crime(2010,last,'Opgehelderde Misdrijven Relatief'), id="line-solved-crime", style={"width": "50vw", 'max-width': '900px'})
+    slider_solved_crime = html.Div([dcc.RangeSlider(2010, last, 2, marks={i: '{}'.format(i) for i in range(2010, last + 1)},
+                                       value=[2010, last - 1], id='range-slider-solved-crime'),
+                                    dcc.Store(id='trend-solved-crime', data=yearly_trend('Opgehelderde Misdrijven Relatief').to_store())],
+                      style={"width": '70%', 'padding-left': '25%', 'margin-bottom': '50px'})
+
+    datatext = page_text()
+    return html.Div([dcc.Markdown('# Ontwikkeling misdaad per gemeente', style={'text-align': 'center'}),
+                      dcc.Markdown(datatext[0], className='textbox'),
+                      html.Div([dbc.Row([create_crime_table()])],id = 'table_div'),
+                      dcc.Markdown(datatext[1], className='textbox'),
+                      html.Div([scatter_graph, scatter_view]),
+                      html.Hr(),
+                      dcc.Markdown('# Ontwikkeling misdaad per categorie', style={'text-align': 'center'}),
+                      dcc.Markdown(datatext[2], className='textbox'),
+                      #dropdown,
+                      dbc.Row([bars_dev_crime, line_dev_crime]),
+                      slider_crime,
+                      dcc.Markdown(datatext[3], className='textbox'),
+                      dbc.Row([bars_dev_solved_crime, line_dev_solved_crime]),
+                      slider_solved_crime
+                      ],
+                     style={'max-width': '2000px', 'margin': 'auto'})
+
+def layout():
+    return build_layout(get_store().version)
+
+@on_refresh
+def refresh_figures(refresh):
+    if refresh.gemeenten or refresh.new_year:
+        datatable_crime_df.cache_clear()
+        scatter_df.cache_clear()
+        create_scatter.invalidate()
+    if 'Nederland' in refresh.regions: # the yearly trends, see crime/trends.py
+        bars_crime_change.invalidate()
+        line_yearly_crime.invalidate()
+
+
+#callbacks to update the table and graphs
 
 @callback(
-    Output('line-graph', 'figure'),
-    [Input('range-slider-crime', 'value')])
-
-def update_line_yearly_crime(year):
-    return line_yearly_crime(year[0],year[1], 'Geregistreerde Misdrijven')
-
-
-@callback(
-    Output("bars-change-graph", 'figure'),
-    [Input('range-slider-crime', 'value')])
-
-def update_change_bars(year):
-    return bars_crime_change(year[0],year[1],'Geregistreerde Misdrijven')
-
-@callback(
-    Output('line-solved-crime', 'figure'),
-    [Input('range-slider-solved-crime', 'value')])
-
-def update_line_yearly_crime(year):
-    return line_yearly_crime(year[0],year[1], 'Opgehelderde Misdrijven Relatief')
-
-
-@callback(
-    Output("bars-solved-crime", 'figure'),
-    [Input('range-slider-solved-crime', 'value')])
+    Output('gemeente-table', 'data'), Output('gemeente-table', 'page_count'),
+    Input('gemeente-table', 'page_current'), Input('gemeente-table', 'page_size'),
+    Input('gemeente-table', 'sort_by'), Input('gemeente-table', 'filter_query'),
+    prevent_initial_call=True)
+def update_gemeente_table(page_current, page_size, sort_by, filter_query):
+    return query_page(datatable_crime_df(), page_current, page_size, sort_by, filter_query)
+
+#zooming only goes to the server when the overview is binned (layout.meta of the figure), with all
+#points in the browser plotly zooms by itself
+clientside_callback(
+    ClientsideFunction(namespace='inzichten', function_name='scatterView'),
+    Output('scatter-view', 'data'),
+    Input('scatter-graph', 'relayoutData'), State('scatter-graph', 'figure'), prevent_initial_call=True)
+
+@callback(Output('scatter-graph', 'figure'), Input('scatter-view', 'data'), prevent_initial_call=True)
+def zoom_scatter(relayout):
+    # the points of the zoomed area instead of the binned overview
+    view = axis_view(relayout)
+    if view is None or len(scatter_df()) <= SCATTER_MAX_POINTS:
+        return no_update
+    fig = Patch()
+    fig['data'] = [scatter_points(view)]
+    return fig
 
-def update_change_bars(year):
-    return bars_crime_change(year[0],year[1],'Opgehelderde Misdrijven Relatief')
\ No newline at end of file
+#the slider graphs run in the browser (assets/inzichten.js) on the trends stored in the page,
+#the server figures above are only used for their layout and trace styling
+
+for slider, store, bars, line in [('range-slider-crime', 'trend-crime', 'bars-change-graph', 'line-graph'),
+                                  ('range-slider-solved-crime', 'trend-solved-crime', 'bars-solved-crime', 'line-solved-crime')]:
+    clientside_callback(
+        ClientsideFunction(namespace='inzichten', function_name='bars'),
+        Output(bars, 'figure'),
+        Input(slider, 'value'), State(store, 'data'), State(bars, 'figure'))
+    clientside_callback(
+        ClientsideFunction(namespace='inzichten', function_name='line'),
+        Output(line, 'figure'),
+        Input(slider, 'value'), State(store, 'data'), State(line, 'figure'))
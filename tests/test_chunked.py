@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from crime.chunked import CRIME_COLUMNS, read_csv_chunked, widen
+
+# rows of data/Crimefull.csv, with the regions and categories spread so every chunk of 2 rows has
+# other categories, in another order
+ROWS = pd.DataFrame({
+    'ID': range(7),
+    'Regio': ['Nederland', 'Nederland', 'Groningen (PV)', 'Fryslân (PV)', 'Groningen (PV)', 'Assen', 'Nederland'],
+    'RegioS': ['NL01  ', 'NL01  ', 'PV20  ', 'PV21  ', 'PV20  ', 'GM0106', 'NL01  '],
+    'Perioden': [2010, 2011, 2010, 2010, 2011, 2011, 2012],
+    'Misdaad': ['Misdrijven, totaal', '1 Vermogensmisdrijven', '1 Vermogensmisdrijven', 'Misdrijven, totaal',
+                '2 Vernielingen', 'Misdrijven, totaal', '2 Vernielingen'],
+    'CategoryGroupID': [1, 2, 2, 1, 2, 1, 2],
+    'Soortmisdrijf': ['T001161', 'CRI1000', 'CRI1000', 'T001161', 'CRI2000', 'T001161', 'CRI2000'],
+    'Geregistreerde Misdrijven': [861059.0, 215740.0, 9000.0, 30000.0, 2000.0, 3000.0, 2 ** 24 + 1.0],
+    'Geregistreerde Misdrijven Relatief': [100.0, 100.0, 4.2, 3.5, 1.0, 0.3, 100.0],
+    'Misdrijven Per 1000 Inw': [48.9, 12.3, 15.4, 46.3, 3.4, 44.8, np.nan],
+    'Opgehelderde Misdrijven': [136215.0, 67452.0, 2000.0, 5000.0, 500.0, 800.0, 4000.0],
+    'Opgehelderde Misdrijven Relatief': [15.8, 31.3, 22.2, 16.7, 25.0, 26.7, 10.0],
+    'Registraties Van Verdachten': [163458.0, 80942.0, 2500.0, 6000.0, 700.0, 900.0, 5000.0],
+    'BevolkingOp1Januari_1': [17590672.0, 17590672.0, 582161.0, 647282.0, 583990.0, 67000.0, 17590672.0],
+})
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'Crimefull.csv'
+    ROWS.to_csv(path, index=False)
+    return str(path)
+
+
+def test_chunks_give_the_frame_of_read_csv(path):
+    frame = read_csv_chunked(path, chunksize=2)
+    expected = pd.read_csv(path, usecols=CRIME_COLUMNS)[CRIME_COLUMNS]
+    assert frame.columns.tolist() == CRIME_COLUMNS
+    # every chunk had its own categories, the result has the values in the same rows
+    for column in ['Regio', 'RegioS', 'Misdaad']:
+        assert isinstance(frame[column].dtype, pd.CategoricalDtype)
+        assert frame[column].astype(str).tolist() == expected[column].tolist()
+        assert sorted(frame[column].cat.categories) == sorted(expected[column].unique()) # once each
+    pd.testing.assert_frame_equal(widen(frame.drop(columns=['Regio', 'RegioS', 'Misdaad'])),
+                                  expected.drop(columns=['Regio', 'RegioS', 'Misdaad']), check_dtype=False)
+
+
+def test_column_types(path):
+    frame = read_csv_chunked(path, chunksize=2)
+    assert frame.Perioden.dtype == np.int16 and frame.CategoryGroupID.dtype == np.int8
+    assert frame['Opgehelderde Misdrijven'].dtype == np.float32
+    # decimals stay float64, and a chunk with a count float32 can't hold makes the whole column float64
+    assert frame['Misdrijven Per 1000 Inw'].dtype == np.float64
+    assert frame['Geregistreerde Misdrijven'].dtype == np.float64
+    assert frame['Geregistreerde Misdrijven'].iloc[-1] == 2 ** 24 + 1
+    assert widen(frame).dtypes.eq(np.float32).sum() == 0
+
+
+def test_missing_columns_are_skipped(path):
+    frame = read_csv_chunked(path, columns=['Regio', 'Perioden', 'Nope'], chunksize=3)
+    assert frame.columns.tolist() == ['Regio', 'Perioden']
+    assert len(frame) == len(ROWS)
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from crime.hierarchy import category_hierarchy, title_depth
+from crime.store import get_store
+from crime.views import region_table
+
+META = pd.DataFrame({
+    'Key': ['T001161', 'CRI1000', 'CRI1100', 'CRI1110', 'CRI1200', 'CRI3000', 'CRI3624', 'CRI6000', 'CRI6300'],
+    'Title': ['Misdrijven, totaal', '1 Vermogensmisdrijven', '11 Diefstal/verduistering en inbraak',
+              '111 Diefstal en inbraak met geweld', '12 Bedrog', '3 Gewelds- en seksuele misdrijven',
+              '36 Mensenhandel en 244 mensensmokkel', '6 Drugsmisdrijven', '6.3 Drugsmisdrijf (overig)'],
+    'Description': ['Totaal', 'Vermogen', 'Diefstal', 'Met geweld', None, 'Geweld', 'Mensenhandel', 'Drugs', 'NA'],
+    'CategoryGroupID': [1, 2, 2, 2, 2, 4, 4, 7, 7],
+})
+
+
+@pytest.mark.parametrize('title, depth', [
+    ('Misdrijven, totaal', 0), ('1 Vermogensmisdrijven', 1), ('11 Diefstal/verduistering en inbraak', 2),
+    ('111 Diefstal en inbraak met geweld', 3), ('6.3 Drugsmisdrijf (overig)', 2),
+    ('36 Mensenhandel en 244 mensensmokkel', 2), # only the digits of the leading code
+])
+def test_title_depth(title, depth):
+    assert title_depth(title) == depth
+
+
+def test_category_hierarchy():
+    hierarchy = category_hierarchy(META)
+    assert hierarchy.index.tolist() == META.Title.tolist()
+    assert hierarchy.depth.tolist() == [0, 1, 2, 3, 2, 1, 2, 1, 2]
+    assert hierarchy.parent.tolist() == [None, 'Misdrijven, totaal', '1 Vermogensmisdrijven',
+                                         '11 Diefstal/verduistering en inbraak', '1 Vermogensmisdrijven',
+                                         'Misdrijven, totaal', '3 Gewelds- en seksuele misdrijven',
+                                         'Misdrijven, totaal', '6 Drugsmisdrijven']
+    assert hierarchy.loc['12 Bedrog', 'tooltip'] == ''
+    assert hierarchy.loc['6.3 Drugsmisdrijf (overig)', ['Key', 'CategoryGroupID']].tolist() == ['CRI6300', 7]
+
+
+@pytest.mark.parametrize('depth', [0, 1, 2, 3, 4])
+def test_region_table_depth(depth):
+    rows, tooltips = region_table('Nederland')
+    shown, shown_tooltips = region_table('Nederland', depth)
+    # the rows down to depth, in the same order and each with its own tooltip
+    expected = [i for i, row in enumerate(rows) if row['Indent'] <= depth]
+    assert shown == [rows[i] for i in expected]
+    assert shown_tooltips == [tooltips[i] for i in expected]
+    hierarchy = get_store().hierarchy
+    assert all(row['Indent'] == hierarchy.loc[row['Misdaad'], 'depth'] for row in shown)
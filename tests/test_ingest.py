@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+import crime.store
+from crime.ingest import apply_changes, changed_rows, normalize
+from crime.store import CrimeStore, load_store
+from crime.views import build_region_view
+
+REGIONS = ['Nederland', 'Groningen (PV)', 'Fryslân (PV)']
+# field names of the CBS OData API (table 83648NED) for the value columns, in both spellings it has used
+ODATA_FIELDS = {
+    'Geregistreerde Misdrijven': ['GeregistreerdeMisdrijven_1', 'TotaalGeregistreerdeMisdrijven_1'],
+    'Geregistreerde Misdrijven Relatief': ['GeregistreerdeMisdrijvenRelatief_2'] * 2,
+    'Misdrijven Per 1000 Inw': ['GeregistreerdeMisdrijvenPer1000Inw_3'] * 2,
+    'Opgehelderde Misdrijven': ['OpgehelderdeMisdrijven_4', 'TotaalOpgehelderdeMisdrijven_4'],
+    'Opgehelderde Misdrijven Relatief': ['OpgehelderdeMisdrijvenRelatief_5'] * 2,
+    'Registraties Van Verdachten': ['RegistratiesVanVerdachten_6'] * 2,
+}
+
+
+@pytest.fixture
+def store():
+    # a few regions of the data files, as the store the pages use
+    full = load_store()
+    small = CrimeStore(full.frame.loc[full.frame.Regio.isin(REGIONS)], full.meta, full.populatie.reset_index())
+    old, crime.store._store = crime.store._store, small
+    yield small
+    crime.store._store = old
+
+
+def next_year(store, regions):
+    # the latest year of the given regions again, as the year after
+    rows = store.frame.loc[(store.frame.Perioden == store.latest_year) & store.frame.Regio.isin(regions)]
+    return rows.assign(Perioden=store.latest_year + 1, Regio=rows.Regio.astype(str),
+                       RegioS=rows.RegioS.astype(str), Misdaad=rows.Misdaad.astype(str))
+
+
+def odata(store, spelling):
+    # the latest year of the store as an OData export, with a quarter that is left out
+    rows = store.frame.loc[store.frame.Perioden == store.latest_year]
+    keys = dict(zip(store.meta.Title, store.meta.Key))
+    data = pd.DataFrame({'ID': range(len(rows)), 'SoortMisdrijf': rows.Misdaad.map(keys).astype(str).to_numpy(),
+                         'RegioS': rows.RegioS.astype(str).str.strip().to_numpy(),
+                         'Perioden': f'{store.latest_year}JJ00'})
+    for column, fields in ODATA_FIELDS.items():
+        data[fields[spelling]] = rows[column].to_numpy()
+    return pd.concat([data, data.assign(Perioden=f'{store.latest_year}KW01')], ignore_index=True)
+
+
+def apply(store, delta):
+    new = apply_changes(store, changed_rows(store, normalize(delta, store)), 'delta')
+    crime.store._store = new
+    return new
+
+
+def test_partial_year_keeps_latest_year(store):
+    new = apply(store, next_year(store, REGIONS[:1]))
+    assert new.latest_year == store.latest_year
+    for regio in REGIONS: # the regions without the new year were a KeyError
+        assert build_region_view(regio)['table']
+
+
+def test_complete_year_becomes_latest_year(store):
+    new = apply(store, next_year(store, REGIONS[:1]))
+    new = apply(new, next_year(store, REGIONS[1:]))
+    assert new.latest_year == store.latest_year + 1
+    for regio in REGIONS:
+        assert build_region_view(regio)['table']
+
+
+@pytest.mark.parametrize('spelling', [0, 1])
+def test_normalize_odata_fields(store, spelling):
+    data = normalize(odata(store, spelling), store)
+    rows = store.frame.loc[store.frame.Perioden == store.latest_year]
+    assert len(data) == len(rows)
+    assert data.columns.tolist() == store.frame.columns.tolist()
+    assert data.Regio.tolist() == rows.Regio.astype(str).tolist()
+    assert data.RegioS.tolist() == rows.RegioS.astype(str).tolist() # padded as in the data files
+    assert data.Misdaad.tolist() == rows.Misdaad.astype(str).tolist()
+    assert changed_rows(store, data).empty
+
+
+def test_normalize_names_missing_columns(store):
+    with pytest.raises(ValueError, match='Opgehelderde Misdrijven Relatief'):
+        normalize(odata(store, 0).drop(columns='OpgehelderdeMisdrijvenRelatief_5'), store)
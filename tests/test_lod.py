@@ -0,0 +1,40 @@
+import geopandas as gpd
+import pytest
+import shapely
+
+import crime.lod
+from crime.lod import MapLevel, level_for_view
+
+
+def grid(name, step, min_zoom):
+    # squares of step degrees over (0, 0) - (1, 1)
+    cells = int(round(1 / step))
+    boxes = [shapely.box(i * step, j * step, (i + 1) * step, (j + 1) * step) for i in range(cells) for j in range(cells)]
+    frame = gpd.GeoDataFrame({'statcode': [f'{name}{n}' for n in range(len(boxes))]}, geometry=boxes, crs=4326)
+    return MapLevel(name, frame, min_zoom)
+
+
+@pytest.fixture
+def levels(monkeypatch):
+    # 100 wijken and 2500 buurten
+    levels = [grid('WK', 0.1, 9), grid('BU', 0.02, 11.5)]
+    monkeypatch.setattr(crime.lod, '_levels', levels)
+    monkeypatch.setattr(crime.lod, 'MAX_FEATURES', 1000)
+    return levels
+
+
+def test_finest_level_for_zoom(levels):
+    assert level_for_view(8, (0, 0, 0.1, 0.1)) == (None, None)
+    level, frame = level_for_view(10, (0, 0, 0.1, 0.1))
+    assert level.name == 'WK'
+    level, frame = level_for_view(12, (0, 0, 0.1, 0.1))
+    assert level.name == 'BU'
+    assert len(frame) == len(levels[1].query((0, 0, 0.1, 0.1)))
+
+
+def test_view_with_too_many_features_takes_coarser_level(levels):
+    # the whole grid is 2500 buurten, more than MAX_FEATURES: the wijken instead of a cut off part
+    level, frame = level_for_view(12, (0, 0, 1, 1))
+    assert level.name == 'WK'
+    assert len(frame) == 100
+    assert levels[1].query((0, 0, 1, 1), 1000) is None
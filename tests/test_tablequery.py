@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from crime.tablequery import FilterError, parse_filter, query_page
+
+# the shape of the gemeente table of page2: Regio, one column per year and Verschil
+FRAME = pd.DataFrame({
+    'Regio': ['Amsterdam', 'amstelveen', 'Rotterdam', "'s-Gravenhage", 'Den Helder', 'Ameland'],
+    '2021': [90.5, 40.0, 75.25, 70.0, 57.3, np.nan],
+    '2022': [88.0, 41.5, 80.0, 68.0, 57.0, 20.0],
+    'Verschil': [-2.5, 1.5, 4.75, -2.0, -0.3, np.nan],
+})
+
+
+def regions(query, sort_by=None):
+    records, _ = query_page(FRAME, 0, 100, sort_by, query)
+    return [record['Regio'] for record in records]
+
+
+def expected(mask):
+    return FRAME.loc[mask, 'Regio'].tolist()
+
+
+@pytest.mark.parametrize('operator, compare', [
+    ('=', FRAME['2022'].eq), ('eq', FRAME['2022'].eq), ('!=', FRAME['2022'].ne), ('ne', FRAME['2022'].ne),
+    ('<', FRAME['2022'].lt), ('lt', FRAME['2022'].lt), ('<=', FRAME['2022'].le), ('le', FRAME['2022'].le),
+    ('>', FRAME['2022'].gt), ('gt', FRAME['2022'].gt), ('>=', FRAME['2022'].ge), ('ge', FRAME['2022'].ge),
+])
+def test_numeric_operators(operator, compare):
+    assert regions(f'{{2022}} {operator} 68') == expected(compare(68))
+
+
+def test_missing_values_compare_like_pandas():
+    assert regions('{2021} < 60') == expected(FRAME['2021'] < 60)
+    assert regions('{2021} != 1') == expected(FRAME['2021'].ne(1))
+
+
+def test_text_is_case_insensitive_by_default():
+    assert regions('{Regio} = amsterdam') == ['Amsterdam']
+    assert regions('{Regio} ieq AMSTERDAM') == ['Amsterdam']
+    assert regions('{Regio} seq amsterdam') == []
+    assert regions('{Regio} s= Amsterdam') == ['Amsterdam']
+    assert regions('{Regio} i< b') == expected(FRAME.Regio.str.lower() < 'b')
+    assert regions('{Regio} s< b') == expected(FRAME.Regio < 'b')
+    records, _ = query_page(FRAME, 0, 100, filter_query='{Regio} = amsterdam', case_sensitive=True)
+    assert records == []
+
+
+def test_contains():
+    assert regions('{Regio} contains AMS') == expected(FRAME.Regio.str.lower().str.contains('ams'))
+    assert regions('{Regio} scontains Ams') == ['Amsterdam']
+    assert regions('{Regio} contains .') == [] # no regular expression
+    # numbers match as text, without the '.0' of whole numbers
+    assert regions('{2021} contains 57') == ['Den Helder']
+    assert regions('{2022} contains 57') == ['Den Helder']
+
+
+def test_and():
+    query = '{Regio} contains am && {2022} > 50 && {Verschil} < 0'
+    assert regions(query) == expected(FRAME.Regio.str.lower().str.contains('am') & (FRAME['2022'] > 50)
+                                      & (FRAME.Verschil < 0))
+    assert regions('{Regio} contains am && ') == regions('{Regio} contains am') # typing the next part
+
+
+def test_quoted_values():
+    assert regions('{Regio} = "Den Helder"') == ['Den Helder']
+    assert regions("{Regio} = ''s-Gravenhage'") == ["'s-Gravenhage"]
+    assert regions('{Regio} contains `den h`') == ['Den Helder']
+    # a quoted number is text: the column is compared as text
+    assert regions('{2022} contains "88"') == ['Amsterdam']
+
+
+def test_blank():
+    assert regions('{Verschil} is blank') == ['Ameland']
+    assert regions('{Verschil} is not blank') == expected(FRAME.Verschil.notna())
+
+
+@pytest.mark.parametrize('query', ['{', '{Regio', '{Regio}', '{Regio} ', '{Regio} contains', '{2022} >',
+                                   '{2022} ~ 5', '{Gemeente} = 5', '{Regio} contains am &&', '&& {2022} > 5',
+                                   'Regio = 5', '{2022} > 5 && {2022'])
+def test_unfinished_query_shows_no_rows(query):
+    records, page_count = query_page(FRAME, 0, 10, None, query)
+    assert records == []
+    assert page_count == 1
+
+
+def test_parse_filter_rejects_unfinished_parts():
+    with pytest.raises(FilterError):
+        parse_filter('{2022} >')
+    assert parse_filter('') == parse_filter(None) == []
+
+
+def test_sort():
+    by_2022 = [{'column_id': '2022', 'direction': 'desc'}]
+    assert regions(None, by_2022) == FRAME.sort_values('2022', ascending=False).Regio.tolist()
+    # text sorts without regard to case, missing values last in both directions
+    by_regio = [{'column_id': 'Regio', 'direction': 'asc'}]
+    assert regions(None, by_regio) == sorted(FRAME.Regio, key=str.lower)
+    for direction in ('asc', 'desc'):
+        assert regions(None, [{'column_id': 'Verschil', 'direction': direction}])[-1] == 'Ameland'
+    by_two = [{'column_id': 'Verschil', 'direction': 'asc'}, {'column_id': 'Regio', 'direction': 'desc'}]
+    assert regions(None, by_two) == FRAME.sort_values(['Verschil', 'Regio'], ascending=[True, False]).Regio.tolist()
+
+
+def test_pages():
+    by_regio = [{'column_id': 'Regio', 'direction': 'asc'}]
+    ordered = sorted(FRAME.Regio, key=str.lower)
+    pages = [query_page(FRAME, page, 4, by_regio) for page in range(3)]
+    assert [[record['Regio'] for record in records] for records, _ in pages] == [ordered[:4], ordered[4:], []]
+    assert {page_count for _, page_count in pages} == {2}
+    assert query_page(FRAME, None, 4)[0] == FRAME.iloc[:4].to_dict('records')
+    records, page_count = query_page(FRAME, 0, 2, by_regio, '{2022} > 60')
+    assert [record['Regio'] for record in records] == sorted(expected(FRAME['2022'] > 60), key=str.lower)[:2]
+    assert page_count == 2
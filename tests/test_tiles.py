@@ -0,0 +1,142 @@
+import math
+import struct
+
+import flask
+import geopandas as gpd
+import pytest
+import shapely
+
+from crime.tiles import EXTENT, TILE_LAYER, encode_tile, register_tile_route
+
+# latitudes of the rows 2048, 3072 and 3584 of tile 1/1/0
+LAT_2048, LAT_3072, LAT_3584 = (math.degrees(math.atan(math.sinh(math.pi / k))) for k in (2, 4, 8))
+
+
+# protobuf decoding, just enough to read back a vector tile
+
+def varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def fields(data):
+    # (field number, value) of a message, length delimited fields as bytes
+    pos = 0
+    while pos < len(data):
+        key, pos = varint(data, pos)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = varint(data, pos)
+        elif wire == 1:
+            value, pos = struct.unpack_from('<d', data, pos)[0], pos + 8
+        elif wire == 2:
+            size, pos = varint(data, pos)
+            value, pos = data[pos:pos + size], pos + size
+        else:
+            raise ValueError(f'wire type {wire}')
+        yield number, value
+
+
+def packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = varint(data, pos)
+        values.append(value)
+    return values
+
+
+def rings(commands):
+    # closed rings in tile coordinates from the geometry commands of one feature
+    x = y = i = 0
+    found = []
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == 7:
+            found[-1].append(found[-1][0])
+            continue
+        for _ in range(count):
+            dx, dy = commands[i], commands[i + 1]
+            x, y = x + ((dx >> 1) ^ -(dx & 1)), y + ((dy >> 1) ^ -(dy & 1))
+            i += 2
+            if command == 1:
+                found.append([(x, y)])
+            else:
+                found[-1].append((x, y))
+    return found
+
+
+def value(data):
+    # the one field of a Value message: 1 string, 3 double
+    [(number, value)] = fields(data)
+    return value.decode() if number == 1 else value
+
+
+def decode_tile(data):
+    decoded = []
+    for _, layer in fields(data):
+        layer = list(fields(layer))
+        keys = [key.decode() for number, key in layer if number == 3]
+        values = [value(data) for number, data in layer if number == 4]
+        features = []
+        for feature in (data for number, data in layer if number == 2):
+            feature = dict(fields(feature))
+            tags = packed(feature[2])
+            features.append({'id': feature[1], 'type': feature[3], 'rings': rings(packed(feature[4])),
+                             'properties': {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}})
+        layer = dict(layer)
+        decoded.append({'name': layer[1].decode(), 'version': layer[15], 'extent': layer[5], 'features': features})
+    return decoded
+
+
+def area(ring):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:]))
+
+
+def test_encode_tile_round_trip():
+    outer = [(0, 0), (90, 0), (90, LAT_2048), (0, LAT_2048)]
+    hole = [(22.5, LAT_3584), (45, LAT_3584), (45, LAT_3072), (22.5, LAT_3072)]
+    frame = gpd.GeoDataFrame({'statcode': ['GM0001', 'GM0002'], 'statnaam': ['Een', 'Twee'],
+                              'Misdrijven Per 1000 Inw': [12.5, float('nan')]},
+                             geometry=[shapely.Polygon(outer, [hole]), shapely.box(90, 0, 135, LAT_3072)])
+    [layer] = decode_tile(encode_tile(frame, 1, 1, 0))
+    assert (layer['name'], layer['version'], layer['extent']) == (TILE_LAYER, 2, EXTENT)
+    assert len(layer['features']) == 2
+
+    first, second = layer['features']
+    assert first['properties'] == {'statcode': 'GM0001', 'statnaam': 'Een', 'Misdrijven Per 1000 Inw': 12.5}
+    assert second['properties'] == {'statcode': 'GM0002', 'statnaam': 'Twee'} # NaN values are left out
+    assert first['type'] == second['type'] == 3 # polygon
+
+    exterior, interior = first['rings']
+    assert area(exterior) > 0 and area(interior) < 0 # winding order of the spec, y down
+    expected = shapely.Polygon([(0, 4096), (2048, 4096), (2048, 2048), (0, 2048)],
+                               [[(512, 3584), (1024, 3584), (1024, 3072), (512, 3072)]])
+    assert shapely.Polygon(exterior, [interior]).equals(expected)
+    [ring] = second['rings']
+    assert shapely.Polygon(ring).equals(shapely.box(2048, 3072, 3072, 4096))
+
+
+@pytest.fixture
+def client():
+    server = flask.Flask(__name__)
+    register_tile_route(server)
+    return server.test_client()
+
+
+@pytest.mark.parametrize('query', ['bins=0', 'bins=-1', 'bins=100000', 'bins=8&klasse=8', 'bins=8&klasse=-1',
+                                   'klasse=8'])
+def test_tile_rejects_bad_query(client, query):
+    assert client.get(f'/tiles/7/65/42.pbf?color=Misdrijven Per 1000 Inw&{query}').status_code == 400
+
+
+def test_tile_accepts_class_in_range(client):
+    response = client.get('/tiles/7/65/42.pbf?color=Misdrijven Per 1000 Inw&bins=32&klasse=31')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/vnd.mapbox-vector-tile'
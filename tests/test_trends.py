@@ -0,0 +1,47 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from crime.trends import PARAMETERS, crimes_per_year, yearly_trend
+
+
+def reference(parameter):
+    # the pivot the page functions computed on every call before the tensor
+    return crimes_per_year(parameter).astype('float64')
+
+
+@pytest.mark.parametrize('parameter', PARAMETERS)
+def test_between_every_year_pair(parameter):
+    df = reference(parameter)
+    trend = yearly_trend(parameter)
+    for year1, year2 in itertools.product(df.index, repeat=2):
+        if parameter == 'Opgehelderde Misdrijven Relatief':
+            expected = round(df.loc[year2] - df.loc[year1], 2)
+        else:
+            expected = round(df.loc[year2] / df.loc[year1] * 100, 1)
+        pd.testing.assert_series_equal(trend.between(year1, year2), expected, check_names=False)
+
+
+@pytest.mark.parametrize('parameter', PARAMETERS)
+def test_development_every_year_pair(parameter):
+    df = reference(parameter)
+    trend = yearly_trend(parameter)
+    for year1, year2 in itertools.combinations(df.index, 2):
+        expected = df.loc[year1:year2]
+        if parameter == 'Geregistreerde Misdrijven':
+            expected = round(expected.div(expected.loc[year1]) * 100, 1)
+        pd.testing.assert_frame_equal(trend.development(year1, year2), expected, check_names=False,
+                                      check_index_type=False, check_column_type=False)
+
+
+def test_to_store():
+    trend = yearly_trend('Geregistreerde Misdrijven')
+    data = trend.to_store()
+    years, categories = len(trend.years), len(trend.categories)
+    assert data['years'] == trend.years.tolist() and not data['difference']
+    assert np.shape(data['values']) == (years, categories)
+    assert np.shape(data['change']) == (years, years, categories)
+    # a year compared with itself is 100%
+    assert all(data['change'][i][i] == [100.0] * categories for i in range(years))